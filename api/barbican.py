@@ -13,10 +13,18 @@
 # Python Wrapper for openstack barbican. Used in the key-manager dashboard
 # v.0.1 - Initial Implementation - Marco Caimi <marco.caimi@fastweb.it>
 
+import calendar
+import collections
+import datetime
+import hashlib
 import logging
+import threading
+import time
+from concurrent import futures
 from keystoneauth1.identity import v2, v3
-from keystoneauth1 import session
 from django.conf import settings
+from django.core.cache import caches
+from django.utils import dateparse
 
 # import base api library from openstack dashboard codebase
 from openstack_dashboard.api import base
@@ -27,75 +35,833 @@ from horizon.utils.memoized import memoized
 # import barbican SDK libraries
 from barbicanclient import client
 
+from openstack_dashboard.api import barbican_breaker
+from openstack_dashboard.api.barbican_metrics import bind_stats
+from openstack_dashboard.api.barbican_metrics import instrumented
+
 LOG = logging.getLogger(__name__)
 API_LIMIT = getattr(settings, 'API_RESULT_LIMIT', 1000)
 
-DEBUGLOG = True
+API_PAGE_SIZE = getattr(settings, 'KEYMANAGER_PAGE_SIZE', None)
+API_MAX_WORKERS = getattr(settings, 'KEYMANAGER_MAX_WORKERS', 8)
+JOB_ITEM_WORKERS = getattr(settings, 'KEYMANAGER_JOB_ITEM_WORKERS', API_MAX_WORKERS)
+CLIENT_CACHE_SIZE = getattr(settings, 'KEYMANAGER_CLIENT_CACHE_SIZE', 256)
+CLIENT_CACHE_TTL = getattr(settings, 'KEYMANAGER_CLIENT_CACHE_TTL', 3600)
+LISTING_CACHE_BACKEND = getattr(settings, 'KEYMANAGER_CACHE_BACKEND', 'default')
+LISTING_CACHE_TTL = getattr(settings, 'KEYMANAGER_CACHE_TTL', 30)
+STALE_LISTING_TTL = getattr(settings, 'KEYMANAGER_STALE_TTL', 86400)
+ENDPOINT_TYPE = getattr(settings, 'KEYMANAGER_ENDPOINT_TYPE',
+                        getattr(settings, 'OPENSTACK_ENDPOINT_TYPE', 'publicURL'))
+X509_INDEX_BACKEND = getattr(settings, 'KEYMANAGER_X509_INDEX_BACKEND', LISTING_CACHE_BACKEND)
+INVENTORY_MAX_WORKERS = getattr(settings, 'KEYMANAGER_INVENTORY_WORKERS', API_MAX_WORKERS)
+
+DEBUGLOG = getattr(settings, 'KEYMANAGER_DEBUG_LOG', False)
 
-def logwrap_info(message):
+def logwrap_info(message, *args):
     if DEBUGLOG:
-        LOG.info("BARBICAN API WRAPPER: %s" % message)
+        LOG.info("BARBICAN API WRAPPER: " + message, *args)
 
-# wrapper around the keymanager API set
-@memoized
-def keymanagerclient(request):
-    token = request.user.token.id
+# process wide worker pool used to fan out independent barbican calls
+_EXECUTOR = None
+
+def _executor():
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = futures.ThreadPoolExecutor(max_workers=API_MAX_WORKERS)
+    return _EXECUTOR
+
+# submit to the worker pool, accounting the call to the current request
+def _submit(func, *args):
+    return _executor().submit(bind_stats(func), *args)
+
+# bulk operations run by background jobs fan out on a pool of their own,
+# so a long job never queues ahead of the calls made while serving a page
+_JOB_EXECUTOR = None
+
+def _job_executor():
+    global _JOB_EXECUTOR
+    if _JOB_EXECUTOR is None:
+        _JOB_EXECUTOR = futures.ThreadPoolExecutor(max_workers=JOB_ITEM_WORKERS)
+    return _JOB_EXECUTOR
+
+def _submit_job(func, *args):
+    return _job_executor().submit(bind_stats(func), *args)
+
+# run func over items on the worker pool ('submit' picks the pool).
+# Returns the items that succeeded and a list of (item, exception) for
+# the ones that failed. 'progress' is called with (item, error) as every
+# item completes.
+def _run_batch(func, items, progress=None, submit=_submit):
+    succeeded = []
+    failed = []
+    jobs = dict((submit(func, item), item) for item in items)
+    for job in futures.as_completed(jobs):
+        error = job.exception()
+        if error is None:
+            succeeded.append(jobs[job])
+        else:
+            failed.append((jobs[job], error))
+        if progress is not None:
+            progress(jobs[job], error)
+    return succeeded, failed
+
+# number of rows shown on a keymanager index page. Falls back to the
+# user's horizon page size preference when not configured.
+def get_page_size(request):
+    if API_PAGE_SIZE:
+        return API_PAGE_SIZE
+    return functions.get_page_size(request)
+
+# process wide cache of barbican clients, keyed by (token, project, domain,
+# endpoint).
+# Reusing a client keeps its keystone session, scoped token and pooled
+# HTTPS connections alive across dashboard requests.
+_CLIENT_CACHE = collections.OrderedDict()
+_CLIENT_CACHE_LOCK = threading.Lock()
 
+def _token_expiry(token):
+    expires = getattr(token, 'expires', None)
+    if expires is None:
+        return None
+    return calendar.timegm(expires.utctimetuple())
+
+# key-manager endpoints resolved from the service catalog, per region
+_ENDPOINT_CACHE = {}
+
+def keymanager_endpoint(request):
+    region = getattr(request.user, 'services_region', None)
+    key = (region, ENDPOINT_TYPE)
+    endpoint = _ENDPOINT_CACHE.get(key)
+    if endpoint is None:
+        endpoint = base.url_for(request, 'key-manager', endpoint_type=ENDPOINT_TYPE).rstrip('/')
+        if endpoint.endswith('/v1'):
+            endpoint = endpoint[:-len('/v1')]
+        logwrap_info("using key-manager endpoint %s for region %s", endpoint, region)
+        _ENDPOINT_CACHE[key] = endpoint
+    return endpoint
+
+# keystone endpoint the dashboard user authenticated against
+def _auth_url(request, version):
+    auth_url = (getattr(request.user, 'endpoint', None) or
+                settings.OPENSTACK_KEYSTONE_URL).rstrip('/')
+    for suffix in ('/v2.0', '/v3'):
+        if auth_url.endswith(suffix):
+            auth_url = auth_url[:-len(suffix)]
+    return "%s/%s" % (auth_url, version)
+
+def _build_client(token, project_id, domain_id, auth_url, endpoint):
     if keystone.get_version() < 3:
-        tenant_id = request.user.tenant_id
         logwrap_info("using keystone v2")
-        ks_auth = v2.Token("https://%s:5000/v2.0" % settings.OPENSTACK_HOST, 
-                        token=token, tenant_id=tenant_id)
+        ks_auth = v2.Token(auth_url, token=token, tenant_id=project_id)
     else:
-        project_id = request.user.project_id
-        domain_id = request.session.get('domain_context')
         logwrap_info("using keystone v3")
-        ks_auth = v3.Token("https://%s:5000/v3" % settings.OPENSTACK_HOST, 
+        ks_auth = v3.Token(auth_url, 
                         token=token, 
                         project_id=project_id,
                         project_domain_id=domain_id)
 
-    ks_session = session.Session(auth=ks_auth)
-    return client.Client(session=ks_session)
+    ks_session = barbican_breaker.GuardedSession(auth=ks_auth,
+                                                 breaker=barbican_breaker.get_breaker(endpoint))
+    return client.Client(session=ks_session, endpoint=endpoint)
+
+# (project, domain) the barbican client for this request is scoped to
+def _project_scope(request):
+    if keystone.get_version() < 3:
+        return request.user.tenant_id, None
+    return request.user.project_id, request.session.get('domain_context')
+
+# wrapper around the keymanager API set
+def keymanagerclient(request):
+    token = request.user.token
+    project_id, domain_id = _project_scope(request)
+    endpoint = keymanager_endpoint(request)
+
+    key = (token.id, project_id, domain_id, endpoint)
+    now = time.time()
+    with _CLIENT_CACHE_LOCK:
+        entry = _CLIENT_CACHE.pop(key, None)
+        if entry is not None and entry[0] > now:
+            # re-insert to keep the LRU order
+            _CLIENT_CACHE[key] = entry
+            return entry[1]
+
+    version = 'v2.0' if keystone.get_version() < 3 else 'v3'
+    keymanager = _build_client(token.id, project_id, domain_id,
+                               _auth_url(request, version), endpoint)
+
+    expires_at = now + CLIENT_CACHE_TTL
+    token_expiry = _token_expiry(token)
+    if token_expiry is not None:
+        expires_at = min(expires_at, token_expiry)
+
+    with _CLIENT_CACHE_LOCK:
+        _CLIENT_CACHE[key] = (expires_at, keymanager)
+        for stale_key in [k for k, v in _CLIENT_CACHE.items() if v[0] <= now]:
+            del _CLIENT_CACHE[stale_key]
+        while len(_CLIENT_CACHE) > CLIENT_CACHE_SIZE:
+            _CLIENT_CACHE.popitem(last=False)
+
+    return keymanager
+
+# per-project listing cache. Keys embed a generation counter which write
+# operations bump, so every cached page of a project is dropped at once.
+def _listing_cache():
+    return caches[LISTING_CACHE_BACKEND]
+
+def _generation_key(request):
+    project_id, domain_id = _project_scope(request)
+    return "keymanager:%s:%s:generation" % (project_id, domain_id)
+
+def _listing_key(request, entity, params):
+    project_id, domain_id = _project_scope(request)
+    generation = _listing_cache().get(_generation_key(request), 0)
+    digest = hashlib.md5(repr(sorted(params.items())).encode('utf-8')).hexdigest()
+    return "keymanager:%s:%s:%s:%s:%s" % (project_id, domain_id, generation, entity, digest)
+
+def invalidate_listings(request):
+    logwrap_info("invalidating cached listings")
+    cache = _listing_cache()
+    key = _generation_key(request)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+# last known good copy of a cached listing, kept past invalidations and
+# served while barbican is unavailable
+def _stale_key(request, entity, params):
+    project_id, domain_id = _project_scope(request)
+    digest = hashlib.md5(repr(sorted(params.items())).encode('utf-8')).hexdigest()
+    return "keymanager:%s:%s:stale:%s:%s" % (project_id, domain_id, entity, digest)
+
+# whether data served to this request came from the last known good copies
+def is_stale(request):
+    return getattr(request, '_keymanager_stale', False)
+
+def _fetch_listing(request, entity, params):
+    manager = getattr(keymanagerclient(request), entity)
+    response = manager._api.get(entity, params=params)
+    return (response.get(entity, []), response.get('total', 0))
+
+# listings fetched for a request stand-in carrying its own 'listing_ttl'
+# (the pre-warm) are kept that long instead of KEYMANAGER_CACHE_TTL
+def _store_listing(request, entity, params, listing):
+    ttl = getattr(request, 'listing_ttl', None) or LISTING_CACHE_TTL
+    _listing_cache().set(_listing_key(request, entity, params), listing, ttl)
+    _listing_cache().set(_stale_key(request, entity, params), listing, STALE_LISTING_TTL)
+
+# refresh a listing served stale as soon as the breaker closes again
+def _refresh_on_recovery(request, entity, params):
+    scoped = ProjectScopedRequest(request)
+
+    def refresh():
+        try:
+            _store_listing(scoped, entity, params, _fetch_listing(scoped, entity, params))
+        except Exception as e:
+            logwrap_info("unable to refresh the %s listing: %s", entity, e)
+
+    breaker = barbican_breaker.get_breaker(keymanager_endpoint(request))
+    breaker.on_recovery(_stale_key(request, entity, params), lambda: _submit(refresh))
+
+# raw listing of a barbican collection. The listing JSON already carries
+# every attribute the dashboard renders, so rows can be built from it
+# without the per-object GETs the client entity classes would trigger.
+# Cached listings fall back to their last known good copy when barbican
+# is unavailable.
+def _list_entities(request, entity, limit=API_LIMIT, offset=0, use_cache=True, **filters):
+    params = {'limit': limit, 'offset': offset}
+    params.update(dict((k, v) for k, v in filters.items() if v is not None))
+
+    if not use_cache:
+        return _fetch_listing(request, entity, params)
+
+    cached = _listing_cache().get(_listing_key(request, entity, params))
+    if cached is not None:
+        return cached
+
+    try:
+        listing = _fetch_listing(request, entity, params)
+    except barbican_breaker.OUTAGE_ERRORS as e:
+        stale = _listing_cache().get(_stale_key(request, entity, params))
+        if stale is None:
+            raise
+        LOG.warning("barbican unavailable (%s), serving the last known %s listing", e, entity)
+        request._keymanager_stale = True
+        _refresh_on_recovery(request, entity, params)
+        return stale
+    _store_listing(request, entity, params, listing)
+    return listing
+
+# iterate over a whole collection one page at a time. Pages bypass the
+# listing cache, so memory stays flat however large the collection is.
+def _iter_entities(request, entity, page_size=API_LIMIT, **filters):
+    offset = 0
+    while True:
+        page, total = _list_entities(request, entity, limit=page_size, offset=offset,
+                                     use_cache=False, **filters)
+        for entry in page:
+            yield entry
+        offset += len(page)
+        if not page or offset >= total:
+            break
+
+# collect up to 'limit' entries (all of them when limit is None),
+# following barbican's server side page cap
+def _list_all_entities(request, entity, limit=API_LIMIT, **filters):
+    objects = []
+    while limit is None or len(objects) < limit:
+        page_limit = API_LIMIT if limit is None else limit - len(objects)
+        page, total = _list_entities(request, entity, limit=page_limit,
+                                     offset=len(objects), **filters)
+        objects.extend(page)
+        if not page or len(objects) >= total:
+            break
+    return objects
+
+# fetch a single page and report whether there is data around it
+def _list_page(request, entity, offset=0, limit=None, **filters):
+    limit = limit or get_page_size(request)
+    objects, total = _list_entities(request, entity, limit=limit, offset=offset, **filters)
+    has_more_data = offset + len(objects) < total
+    has_prev_data = offset > 0
+    return objects, has_more_data, has_prev_data
+
+# compact read-only table rows built straight from the listing JSON. Rows
+# hold plain values only, so rendering a table never calls barbican.
+class _Row(object):
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is read-only" % self.__class__.__name__)
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.id)
+
+    # plain dict of the given fields (all of them by default), for JSON
+    def to_dict(self, fields=None):
+        return dict((name, getattr(self, name)) for name in fields or self.__slots__)
+
+    # rows are cached pickled, unpickling bypasses the read-only guard
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
+
+class SecretRow(_Row):
+    __slots__ = ('id', 'secret_ref', 'name', 'secret_type', 'algorithm', 'bit_length',
+                 'mode', 'status', 'expiration', 'created', 'updated',
+                 'certificate', 'expires_in', 'used_by')
+
+    # 'certificate' is the parsed metadata of the certificate index and
+    # 'used_by' the consumer graph entries of the secret
+    @classmethod
+    def from_listing(cls, secret, certificate=None, used_by=()):
+        expires_in = None
+        if certificate:
+            expires_in = (certificate['not_after'] - datetime.datetime.utcnow()).days
+        return cls(id=secret.get('secret_ref'),
+                   secret_ref=secret.get('secret_ref'),
+                   name=secret.get('name'),
+                   secret_type=secret.get('secret_type'),
+                   algorithm=secret.get('algorithm'),
+                   bit_length=secret.get('bit_length'),
+                   mode=secret.get('mode'),
+                   status=secret.get('status'),
+                   expiration=secret.get('expiration'),
+                   created=secret.get('created'),
+                   updated=secret.get('updated'),
+                   certificate=certificate,
+                   expires_in=expires_in,
+                   used_by=tuple(used_by))
+
+class ContainerRow(_Row):
+    __slots__ = ('id', 'container_ref', 'name', 'type', 'status', 'created', 'updated',
+                 'consumers', 'consumer_label', 'consumer_ids', 'secrets')
+
+    # 'secrets_metadata' maps secret refs to their listing entries, used to
+    # show the secret names. The consumer names and ids shown by the table
+    # are worked out here, once per listing.
+    @classmethod
+    def from_listing(cls, container, secrets_metadata):
+        consumers = tuple((x.get('name'), x.get('URL')) for x in container.get('consumers', []))
+        consumer_label = "".join(sorted(set(x[0] for x in consumers if x[0])))
+        consumer_ids = tuple((x[1] or '').split("/")[-1] for x in consumers)
+        secrets = tuple((x.get('name'), x.get('secret_ref'),
+                         secrets_metadata.get(x.get('secret_ref'), x).get('name'))
+                        for x in container.get('secret_refs', []))
+        return cls(id=container.get('container_ref'),
+                   container_ref=container.get('container_ref'),
+                   name=container.get('name'),
+                   type=(container.get('type') or '').lower(),
+                   status=container.get('status'),
+                   created=container.get('created'),
+                   updated=container.get('updated'),
+                   consumers=consumers,
+                   consumer_label=consumer_label,
+                   consumer_ids=consumer_ids,
+                   secrets=secrets)
+
+    # (secret ref, secret name) stored in the given container slot
+    def secret(self, slot):
+        for name, secret_ref, secret_name in self.secrets:
+            if name == slot:
+                return secret_ref, secret_name
+        return None
+
+# one secret or container of the domain-wide inventory
+class InventoryRow(_Row):
+    __slots__ = ('id', 'project_id', 'project_name', 'kind', 'ref', 'name', 'type',
+                 'status', 'created', 'updated')
+
+    @classmethod
+    def from_listing(cls, project, entity, entry):
+        ref = entry.get('secret_ref' if entity == 'secrets' else 'container_ref')
+        return cls(id=ref,
+                   project_id=project.id,
+                   project_name=project.name,
+                   kind='secret' if entity == 'secrets' else 'container',
+                   ref=ref,
+                   name=entry.get('name'),
+                   type=entry.get('secret_type' if entity == 'secrets' else 'type'),
+                   status=entry.get('status'),
+                   created=entry.get('created'),
+                   updated=entry.get('updated'))
+
+# change fingerprint of the project listings: the total of each listing
+# and, for secrets, the most recent 'updated' timestamp read from a single
+# newest-first entry, plus the generations bumped by dashboard writes and
+# certificate indexing. The container listing can not be sorted, so
+# containers are fingerprinted by their total only. Returns (fingerprint,
+# last modified datetime or None).
+def get_listing_fingerprint(request, entities=('secrets', 'containers')):
+    cache = _listing_cache()
+    parts = [_project_scope(request), cache.get(_generation_key(request), 0),
+             cache.get(_x509_generation_key(request), 0)]
+    last_modified = None
+    for entity in entities:
+        if entity == 'secrets':
+            newest, total = _list_entities(request, entity, limit=1, sort='updated:desc')
+            updated = newest[0].get('updated') if newest else None
+        else:
+            total = _list_entities(request, entity, limit=1)[1]
+            updated = None
+        parts.append((entity, total, updated))
+        updated = dateparse.parse_datetime(updated) if updated else None
+        if updated is not None and (last_modified is None or updated > last_modified):
+            last_modified = updated
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest(), last_modified
+
+# table rows built for a listing fingerprint. 'build' is only called when
+# no rows were built for the same fingerprint within the listing TTL.
+def get_fingerprinted_rows(request, fingerprint, build):
+    project_id, domain_id = _project_scope(request)
+    key = "keymanager:%s:%s:rows:%s" % (project_id, domain_id, fingerprint)
+    rows = _listing_cache().get(key)
+    if rows is None:
+        rows = build()
+        if not is_stale(request):
+            _listing_cache().set(key, rows, LISTING_CACHE_TTL)
+    return rows
 
 # barbican interface functions
-def get_containers(request):
+# 'filters' are passed to the barbican listing query (name, type)
+@instrumented
+def get_containers(request, offset=0, limit=None, paginate=False, **filters):
+    if paginate:
+        logwrap_info("contacting barbican for containers %d+", offset)
+        return _list_page(request, 'containers', offset=offset, limit=limit, **filters)
     logwrap_info("contacting barbican for a complete container list")
-    return keymanagerclient(request).containers.list(limit=API_LIMIT)
+    return _list_all_entities(request, 'containers', limit=limit or API_LIMIT, **filters)
+
+# resolve secret metadata for a set of secret refs. The project secret
+# listing is paged until every ref is found, refs left over (e.g. secrets
+# shared from other projects) are fetched concurrently.
+@instrumented
+def get_secrets_metadata(request, secret_refs):
+    pending = set(secret_refs)
+    metadata = {}
+    if not pending:
+        return metadata
+
+    logwrap_info("resolving metadata for %d secrets", len(pending))
+    offset = 0
+    while pending and offset < API_LIMIT:
+        page, total = _list_entities(request, 'secrets', offset=offset)
+        for secret in page:
+            ref = secret.get('secret_ref')
+            if ref in pending:
+                metadata[ref] = secret
+                pending.discard(ref)
+        offset += len(page)
+        if not page or offset >= total:
+            break
+
+    if pending:
+        api = keymanagerclient(request).secrets._api
+
+        def fetch(ref):
+            return api.get("secrets/%s" % ref.split("/")[-1])
 
-# create named container
+        jobs = dict((_submit(fetch, ref), ref) for ref in pending)
+        for job in futures.as_completed(jobs):
+            try:
+                metadata[jobs[job]] = job.result()
+            except Exception as e:
+                logwrap_info("unable to resolve secret %s: %s", jobs[job], e)
+
+    return metadata
+
+# store a new certificate container and return its ref. The listings are
+# invalidated once barbican holds the container, so no listing cached in
+# between misses it.
+@instrumented
 def create_container(request, name, certificate, private_key):
     logwrap_info("creating new certificate container")
-    return keymanagerclient(request).containers.create_certificate(name, certificate=certificate, private_key=private_key)
+    container_ref = keymanagerclient(request).containers.create_certificate(
+        name, certificate=certificate, private_key=private_key).store()
+    invalidate_listings(request)
+    return container_ref
+
+# iterate over every container of the project, page by page
+def iter_containers(request, page_size=API_LIMIT):
+    logwrap_info("iterating over the complete container list")
+    return _iter_entities(request, 'containers', page_size=page_size)
+
+# reverse index of the project containers: secret ref -> list of
+# (container ref, container name, consumer URLs). Built from one pass over
+# the complete container listing and cached like the listings themselves.
+@instrumented
+def get_consumer_graph(request):
+    cache_key = _listing_key(request, 'consumer_graph', {})
+    graph = _listing_cache().get(cache_key)
+    if graph is not None:
+        return graph
+
+    logwrap_info("building the container consumer graph")
+    graph = {}
+    for container in _list_all_entities(request, 'containers', limit=None):
+        consumers = tuple(x.get('URL') for x in container.get('consumers', []))
+        for secret in container.get('secret_refs', []):
+            graph.setdefault(secret.get('secret_ref'), []).append(
+                (container.get('container_ref'), container.get('name'), consumers))
+    _listing_cache().set(cache_key, graph, LISTING_CACHE_TTL)
+    return graph
 
 # delete named container
+@instrumented
 def delete_container(request, container_ref):
-    logwrap_info("deleting container %s"%container_ref)
-    return keymanagerclient(request).containers.delete(container_ref=container_ref)
+    logwrap_info("deleting container %s", container_ref)
+    result = keymanagerclient(request).containers.delete(container_ref=container_ref)
+    invalidate_listings(request)
+    return result
+
+# delete a batch of containers concurrently. Background jobs pass
+# background=True to run on the job item pool.
+@instrumented
+def delete_containers(request, container_refs, progress=None, background=False):
+    logwrap_info("deleting %d containers", len(container_refs))
+    manager = keymanagerclient(request).containers
+    result = _run_batch(lambda ref: manager.delete(container_ref=ref), container_refs, progress,
+                        _submit_job if background else _submit)
+    invalidate_listings(request)
+    return result
 
-# get secrets
-def get_secrets(request):
+# get secrets. 'filters' are passed to the barbican listing query (name,
+# secret_type, alg, bits, created)
+@instrumented
+def get_secrets(request, offset=0, limit=None, paginate=False, **filters):
+    if paginate:
+        logwrap_info("contacting barbican for secrets %d+", offset)
+        return _list_page(request, 'secrets', offset=offset, limit=limit, **filters)
     logwrap_info("contacting barbican for a complete secret list")
-    return keymanagerclient(request).secrets.list(limit=API_LIMIT)
+    return _list_all_entities(request, 'secrets', limit=limit or API_LIMIT, **filters)
 
-# create new secret
-def create_x509secret(request, name, payload, algorithm, bit_length, mode, secret_type):
-    logwrap_info("creating a new x509 secret")
-    return keymanagerclient(request).secrets.create(name=name, payload=payload, algorithm=algorithm, bit_length=bit_length, mode=mode, secret_type=secret_type)
+# iterate over every secret of the project, page by page
+def iter_secrets(request, page_size=API_LIMIT):
+    logwrap_info("iterating over the complete secret list")
+    return _iter_entities(request, 'secrets', page_size=page_size)
+
+# search secrets by name for the secret pickers. secret_type filtering is
+# done by barbican. Exact name matches are asked to barbican first, then
+# the (cached) listing pages are scanned for substring matches until
+# 'limit' secrets are found or the listing ends.
+@instrumented
+def search_secrets(request, query=None, secret_types=None, match=None, limit=20):
+    logwrap_info("searching secrets matching '%s'", query)
+    needle = (query or '').lower()
+    results = []
+    found = set()
+
+    def add(secret):
+        if secret.get('secret_ref') in found:
+            return False
+        if needle not in (secret.get('name') or '').lower():
+            return False
+        if match is not None and not match(secret):
+            return False
+        found.add(secret.get('secret_ref'))
+        results.append(secret)
+        return len(results) >= limit
+
+    for secret_type in secret_types or (None,):
+        if query:
+            exact, total = _list_entities(request, 'secrets', name=query, secret_type=secret_type)
+            for secret in exact:
+                if add(secret):
+                    return results
+
+    for secret_type in secret_types or (None,):
+        offset = 0
+        while True:
+            page, total = _list_entities(request, 'secrets', offset=offset, secret_type=secret_type)
+            for secret in page:
+                if add(secret):
+                    return results
+            offset += len(page)
+            if not page or offset >= total:
+                break
+    return results
+
+# store a certificate/private key pair as two secrets. Both uploads run
+# concurrently; if one of them fails the other one is deleted again so no
+# half-created pair is left behind, and the original error is raised.
+@instrumented
+def create_x509pair(request, name, certificate, private_key, algorithm, bit_length, mode, secret_type):
+    logwrap_info("creating a new x509 certificate/private key pair")
+    manager = keymanagerclient(request).secrets
+
+    def store(payload):
+        secret_name, secret_payload = payload
+        return manager.create(name=secret_name, payload=secret_payload, algorithm=algorithm,
+                              bit_length=bit_length, mode=mode, secret_type=secret_type).store()
+
+    payloads = ((name + "_crt", certificate), (name + "_key", private_key))
+    jobs = [_submit(store, payload) for payload in payloads]
+    futures.wait(jobs)
+
+    stored = [job.result() for job in jobs if job.exception() is None]
+    errors = [job.exception() for job in jobs if job.exception() is not None]
+    if errors:
+        for secret_ref in stored:
+            logwrap_info("rolling back secret %s", secret_ref)
+            try:
+                manager.delete(secret_ref)
+            except Exception as e:
+                LOG.error("unable to roll back secret %s: %s", secret_ref, e)
+
+    invalidate_listings(request)
+    if errors:
+        raise errors[0]
+    return tuple(stored)
+
+# import many certificate/private key pairs. 'pairs' is a list of
+# (name, certificate, private_key); each pair is stored, and optionally
+# grouped in a certificate container, on the job item pool since imports
+# only run as background jobs. 'progress' is called with (name, error) as
+# every pair completes. Returns the names imported and a list of
+# (name, exception) for the failed ones.
+@instrumented
+def import_x509pairs(request, pairs, algorithm, bit_length, mode, secret_type,
+                     create_containers=False, progress=None):
+    logwrap_info("importing %d x509 certificate/private key pairs", len(pairs))
+    keymanager = keymanagerclient(request)
+
+    def store(pair):
+        name, certificate, private_key = pair
+        stored = []
+        try:
+            for suffix, payload in (("_crt", certificate), ("_key", private_key)):
+                stored.append(keymanager.secrets.create(name=name + suffix, payload=payload,
+                                                        algorithm=algorithm, bit_length=bit_length,
+                                                        mode=mode, secret_type=secret_type).store())
+            if create_containers:
+                keymanager.containers.create_certificate(
+                    name, certificate=keymanager.secrets.get(stored[0]),
+                    private_key=keymanager.secrets.get(stored[1])).store()
+        except Exception:
+            for secret_ref in stored:
+                try:
+                    keymanager.secrets.delete(secret_ref)
+                except Exception as e:
+                    LOG.error("unable to roll back secret %s: %s", secret_ref, e)
+            raise
+        return name
+
+    imported = []
+    failed = []
+    jobs = dict((_submit_job(store, pair), pair[0]) for pair in pairs)
+    for job in futures.as_completed(jobs):
+        error = job.exception()
+        if error is None:
+            imported.append(jobs[job])
+        else:
+            failed.append((jobs[job], error))
+        if progress is not None:
+            progress(jobs[job], error)
+
+    invalidate_listings(request)
+    return imported, failed
+
+# certificate metadata index, keyed by secret ref. Secret payloads never
+# change, so the parsed metadata is kept without expiry. Secrets that do
+# not hold a certificate, or that can never be read, are recorded with a
+# None entry (and the reason in 'error') so they are not decrypted again.
+def _x509_index():
+    return caches[X509_INDEX_BACKEND]
+
+def _x509_key(secret_ref):
+    return "keymanager:x509:%s" % secret_ref.split("/")[-1]
+
+# returns a ref -> metadata map of the indexed secrets among secret_refs
+def get_certificate_index(request, secret_refs):
+    keys = dict((_x509_key(ref), ref) for ref in secret_refs)
+    indexed = _x509_index().get_many(list(keys))
+    return dict((keys[key], value.get('certificate')) for key, value in indexed.items())
+
+# per-project counter bumped as certificates get indexed, part of the
+# listing fingerprint
+def _x509_generation_key(request):
+    project_id, domain_id = _project_scope(request)
+    return "keymanager:%s:%s:x509generation" % (project_id, domain_id)
+
+def set_certificate_index(request, secret_ref, metadata, error=None):
+    entry = {'certificate': metadata}
+    if error is not None:
+        entry['error'] = error
+    _x509_index().set(_x509_key(secret_ref), entry, None)
+    cache = _listing_cache()
+    key = _x509_generation_key(request)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+# claim refs for indexing, returns the ones not already being indexed
+def claim_certificate_index(secret_refs, timeout=600):
+    return [ref for ref in secret_refs
+            if _x509_index().add(_x509_key(ref) + ":pending", True, timeout)]
+
+# fetch the decrypted payload of a secret without a metadata round-trip
+@instrumented
+def get_secret_payload(request, secret_ref, payload_content_type='text/plain'):
+    logwrap_info("getting payload of secret %s", secret_ref)
+    return keymanagerclient(request).secrets.get(secret_ref, payload_content_type=payload_content_type).payload
 
 # get existing secret
+@instrumented
 def get_secret(request, secret_ref):
-    logwrap_info("getting secret %s"%secret_ref)
-    reference = "https://%s:9311/v1/secrets/%s" % (settings.OPENSTACK_HOST, secret_ref)
+    logwrap_info("getting secret %s", secret_ref)
+    reference = "%s/v1/secrets/%s" % (keymanager_endpoint(request), secret_ref)
     return keymanagerclient(request).secrets.get(reference)
 
+# metadata and decrypted payload of a secret in one call. Memoized on the
+# request only: plaintext payloads are never written to a shared cache.
+@memoized
+@instrumented
+def get_secret_with_payload(request, secret_ref):
+    logwrap_info("getting secret %s with its payload", secret_ref)
+    secret = get_secret(request, secret_ref)
+    return {
+        'name': secret.name,
+        'secret_type': secret.secret_type,
+        'payload': secret.payload,
+    }
+
 # create new secret
+@instrumented
 def update_x509secret(request, ref, payload):
     logwrap_info("updateing x509 secret")
-    reference = "https://%s:9311/v1/secrets/%s" % (settings.OPENSTACK_HOST, ref)
-    return keymanagerclient(request).secrets.update(secret_ref=reference, payload=payload)
+    reference = "%s/v1/secrets/%s" % (keymanager_endpoint(request), ref)
+    result = keymanagerclient(request).secrets.update(secret_ref=reference, payload=payload)
+    invalidate_listings(request)
+    return result
 
 # delete secret
+@instrumented
 def delete_secret(request, secret_ref):
-    logwrap_info("deleting secret %s" % secret_ref)
-    return keymanagerclient(request).secrets.delete(secret_ref)
+    logwrap_info("deleting secret %s", secret_ref)
+    result = keymanagerclient(request).secrets.delete(secret_ref)
+    invalidate_listings(request)
+    return result
+
+# delete a batch of secrets concurrently. Background jobs pass
+# background=True to run on the job item pool.
+@instrumented
+def delete_secrets(request, secret_refs, progress=None, background=False):
+    logwrap_info("deleting %d secrets", len(secret_refs))
+    manager = keymanagerclient(request).secrets
+    result = _run_batch(manager.delete, secret_refs, progress,
+                        _submit_job if background else _submit)
+    invalidate_listings(request)
+    return result
+
+# request stand-in scoped to another project of the same user (by default
+# the project of the request, for work outliving the request). The
+# wrapper functions, client cache and listing cache all key on the scope
+# of the request, so they work unchanged on it.
+class _ProjectScopedUser(object):
+    def __init__(self, user, project_id):
+        self._user = user
+        self.project_id = project_id
+        self.tenant_id = project_id
+
+    def __getattr__(self, name):
+        return getattr(self._user, name)
+
+class ProjectScopedRequest(object):
+    def __init__(self, request, project_id=None, listing_ttl=None):
+        if project_id is None:
+            project_id = _project_scope(request)[0]
+        self.user = _ProjectScopedUser(request.user, project_id)
+        self.session = {'domain_context': request.session.get('domain_context')}
+        self.META = {}
+        self.listing_ttl = listing_ttl
+
+# inventory listings get their own pool, so a fan-out over hundreds of
+# projects never starves the per-request calls of the shared one
+_INVENTORY_EXECUTOR = None
+
+def _inventory_executor():
+    global _INVENTORY_EXECUTOR
+    if _INVENTORY_EXECUTOR is None:
+        _INVENTORY_EXECUTOR = futures.ThreadPoolExecutor(max_workers=INVENTORY_MAX_WORKERS)
+    return _INVENTORY_EXECUTOR
+
+# projects the dashboard user has a role on
+@instrumented
+def get_inventory_projects(request):
+    projects, has_more = keystone.tenant_list(request, user=request.user.id)
+    return [x for x in projects if getattr(x, 'enabled', True)]
+
+# list 'entities' of every project on the inventory pool. Yields
+# (project, entity, entries, error) as each listing completes, so callers
+# get the fast projects first and only wait for the slowest one.
+def iter_inventory(request, projects, entities=('secrets', 'containers')):
+    logwrap_info("listing %s of %d projects", ", ".join(entities), len(projects))
+
+    # inventory listings are read once, they bypass the listing cache
+    def list_project(project, entity):
+        scoped = ProjectScopedRequest(request, project.id)
+        return list(_iter_entities(scoped, entity))
+
+    jobs = {}
+    for project in projects:
+        for entity in entities:
+            jobs[_inventory_executor().submit(bind_stats(list_project), project, entity)] = (project, entity)
+    try:
+        for job in futures.as_completed(jobs):
+            project, entity = jobs[job]
+            error = job.exception()
+            if error is not None:
+                LOG.warning("unable to list %s of project %s: %s", entity, project.id, error)
+            yield project, entity, job.result() if error is None else [], error
+    finally:
+        # the client went away, drop the listings not started yet
+        for job in jobs:
+            job.cancel()
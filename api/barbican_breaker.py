@@ -0,0 +1,147 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Circuit breaker for the barbican endpoints. After a run of failed calls
+# the breaker opens and calls fail straight away instead of waiting out
+# the HTTP timeout; a single trial call is let through once the reset
+# timeout has passed, and its outcome closes or re-opens the breaker.
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from keystoneauth1 import exceptions as ks_exceptions
+from barbicanclient import exceptions as barbican_exceptions
+
+from openstack_dashboard.api.barbican_metrics import CountingSession
+
+LOG = logging.getLogger(__name__)
+
+API_TIMEOUT = getattr(settings, 'KEYMANAGER_TIMEOUT', 10)
+BREAKER_THRESHOLD = getattr(settings, 'KEYMANAGER_BREAKER_THRESHOLD', 5)
+BREAKER_RESET = getattr(settings, 'KEYMANAGER_BREAKER_RESET', 30)
+RECOVERY_CALLBACKS = 100
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half-open'
+
+# raised instead of calling barbican while the breaker is open
+class CircuitOpen(Exception):
+    pass
+
+# errors telling that barbican is unavailable, as opposed to a rejected
+# request
+OUTAGE_ERRORS = (CircuitOpen, ks_exceptions.ConnectionError, ks_exceptions.HttpServerError,
+                 barbican_exceptions.HTTPServerError)
+
+class CircuitBreaker(object):
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.recovery = {}
+
+    # whether a call may go through. While open, one trial call is allowed
+    # once the reset timeout has passed; a trial that never reported back
+    # is replaced by a new one after another reset timeout.
+    def allow(self):
+        with self.lock:
+            if self.state == STATE_CLOSED:
+                return True
+            now = time.time()
+            if now - self.opened_at >= self.reset_timeout:
+                self.state = STATE_HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            recovered = self.state != STATE_CLOSED
+            self.state = STATE_CLOSED
+            self.failures = 0
+            callbacks = list(self.recovery.values()) if recovered else []
+            if recovered:
+                self.recovery.clear()
+        if recovered:
+            LOG.warning("barbican endpoint %s recovered, closing the circuit breaker", self.name)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                LOG.error("recovery callback for %s failed: %s", self.name, e)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN or self.failures >= self.threshold:
+                if self.state != STATE_OPEN:
+                    LOG.warning("barbican endpoint %s failing, opening the circuit breaker", self.name)
+                self.state = STATE_OPEN
+                self.opened_at = time.time()
+
+    # run callback once the breaker closes again. Callbacks are keyed so a
+    # refresh is registered only once however often it was asked for.
+    def on_recovery(self, key, callback):
+        with self.lock:
+            if key in self.recovery or len(self.recovery) < RECOVERY_CALLBACKS:
+                self.recovery[key] = callback
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+# breaker of a barbican endpoint, shared by every client talking to it
+def get_breaker(endpoint):
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(endpoint)
+        if breaker is None:
+            breaker = _BREAKERS[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+# keystone session guarding the barbican requests with a breaker. The
+# auth plugin's own (unauthenticated) keystone requests are not guarded.
+class GuardedSession(CountingSession):
+    def __init__(self, breaker=None, timeout=API_TIMEOUT, **kwargs):
+        super(GuardedSession, self).__init__(timeout=timeout, **kwargs)
+        self.breaker = breaker
+
+    def request(self, url, method, **kwargs):
+        if self.breaker is None or kwargs.get('authenticated') is False:
+            return super(GuardedSession, self).request(url, method, **kwargs)
+        if not self.breaker.allow():
+            raise CircuitOpen("barbican endpoint %s is unavailable" % self.breaker.name)
+        try:
+            response = super(GuardedSession, self).request(url, method, **kwargs)
+        except OUTAGE_ERRORS:
+            self.breaker.record_failure()
+            raise
+        except ks_exceptions.HttpError:
+            # barbican answered, it only rejected the request
+            self.breaker.record_success()
+            raise
+        except Exception:
+            # e.g. the token could not be scoped: the call did not go
+            # through, so it can not close the breaker either
+            self.breaker.record_failure()
+            raise
+        # barbicanclient asks for responses instead of HTTP errors
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
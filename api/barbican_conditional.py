@@ -0,0 +1,73 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# ETag / Last-Modified validators for the index views, derived from the
+# barbican listing fingerprint. A browser reloading an unchanged index
+# page gets a 304 without any row being built or template rendered.
+
+import calendar
+import hashlib
+import logging
+
+from django.contrib import messages
+from django.middleware import csrf
+from django.utils import cache
+from django.utils import encoding
+from django.utils import http as http_utils
+
+from openstack_dashboard.api import barbican
+
+LOG = logging.getLogger(__name__)
+
+# values tying a page to the session it was rendered for: the keystone
+# token (user, project, header menus) and the CSRF secret of its forms,
+# both replaced on a new login. The secret is read back from META since
+# get_token masks it differently on every call on newer Django releases.
+def _session_parts(request):
+    token = getattr(request.user, 'token', None)
+    csrf.get_token(request)
+    return [getattr(token, 'id', None) or '', request.META.get('CSRF_COOKIE') or '']
+
+# (etag, last modified) of the page for the current listings, or
+# (None, None) when barbican can not be asked or only stale listings are
+# available. 'extra' values are part of the page beyond the listings
+# themselves.
+def listing_validators(request, entities, *extra):
+    try:
+        fingerprint, last_modified = barbican.get_listing_fingerprint(request, entities)
+    except Exception as e:
+        LOG.warning("unable to fingerprint the %s listings: %s", ", ".join(entities), e)
+        return None, None
+    if barbican.is_stale(request):
+        # stale pages are never validated, the browser keeps asking
+        return None, None
+    parts = ([fingerprint, request.get_full_path()] + _session_parts(request) +
+             [encoding.force_text(x) for x in extra])
+    etag = '"%s"' % hashlib.md5(":".join(parts).encode('utf-8')).hexdigest()
+    return etag, last_modified
+
+# the browser copy is current. Pages carrying pending messages are always
+# rendered, or the messages would never be shown.
+def not_modified(request, etag):
+    if etag is None or request.method != 'GET':
+        return False
+    if request.META.get('HTTP_IF_NONE_MATCH') != etag:
+        return False
+    return not len(messages.get_messages(request))
+
+def set_validators(response, etag, last_modified):
+    if etag is not None:
+        response['ETag'] = etag
+        cache.patch_cache_control(response, private=True, no_cache=True)
+    if last_modified is not None:
+        response['Last-Modified'] = http_utils.http_date(calendar.timegm(last_modified.utctimetuple()))
+    return response
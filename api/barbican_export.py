@@ -0,0 +1,77 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Streaming CSV / NDJSON inventory exports. Rows are produced by lazy
+# generators and written to the client as they are built.
+
+import csv
+import itertools
+import json
+
+from django import http
+from django.utils import encoding
+from django.utils import six
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+CERTIFICATE_FIELDS = ('subject', 'issuer', 'sans', 'not_before', 'not_after',
+                      'key_type', 'key_size', 'fingerprint')
+
+# file-like object handing csv.writer output straight back to the caller
+class _Echo(object):
+    def write(self, value):
+        return value
+
+def _text(value):
+    if value is None:
+        return u''
+    if isinstance(value, (list, tuple)):
+        return u";".join([_text(x) for x in value])
+    return encoding.force_text(value)
+
+# the python 2 csv module only writes byte strings
+def _cell(value):
+    text = _text(value)
+    return text.encode('utf-8') if six.PY2 else text
+
+def _csv_lines(fields, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([_cell(field) for field in fields])
+    for row in rows:
+        yield writer.writerow([_cell(row.get(field)) for field in fields])
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, default=encoding.force_text, sort_keys=True) + "\n"
+
+# split an iterable in lists of at most 'size' entries
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def export_format(request):
+    export_format = request.GET.get('format', 'csv')
+    return export_format if export_format in EXPORT_FORMATS else None
+
+def export_response(rows, fields, export_format, filename):
+    if export_format == 'ndjson':
+        response = http.StreamingHttpResponse(_ndjson_lines(rows),
+                                              content_type='application/x-ndjson')
+    else:
+        response = http.StreamingHttpResponse(_csv_lines(fields, rows),
+                                              content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename, export_format)
+    return response
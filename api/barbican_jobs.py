@@ -0,0 +1,198 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Background jobs for long running key-manager operations. Jobs run on a
+# dedicated worker pool, their state lives in the Django cache so that any
+# dashboard process can report it.
+
+import logging
+import threading
+import time
+import uuid
+from concurrent import futures
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from openstack_dashboard.api import barbican
+from openstack_dashboard.api import base
+
+LOG = logging.getLogger(__name__)
+
+JOB_CACHE_BACKEND = getattr(settings, 'KEYMANAGER_JOB_CACHE_BACKEND',
+                            getattr(settings, 'KEYMANAGER_CACHE_BACKEND', 'default'))
+JOB_TTL = getattr(settings, 'KEYMANAGER_JOB_TTL', 86400)
+JOB_WORKERS = getattr(settings, 'KEYMANAGER_JOB_WORKERS', 4)
+JOB_THRESHOLD = getattr(settings, 'KEYMANAGER_JOB_THRESHOLD', 10)
+JOB_HISTORY = 50
+# failed items kept on a job, and how often progress is written back to
+# the cache: every SAVE_ITEMS items or SAVE_INTERVAL seconds
+JOB_FAILURES = 100
+SAVE_ITEMS = 50
+SAVE_INTERVAL = 2
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_FINISHED = 'finished'
+STATUS_FAILED = 'failed'
+
+class Job(base.APIDictWrapper):
+    _attrs = ['id', 'kind', 'description', 'status', 'total', 'done',
+              'succeeded', 'failed', 'failures', 'error', 'created', 'updated']
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+def _executor():
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = futures.ThreadPoolExecutor(max_workers=JOB_WORKERS)
+    return _EXECUTOR
+
+def _cache():
+    return caches[JOB_CACHE_BACKEND]
+
+def _job_key(job_id):
+    return "keymanager:job:%s" % job_id
+
+def _user_key(user_id):
+    return "keymanager:jobs:%s" % user_id
+
+# progress reporter handed to job functions. Jobs keep counters and only
+# the first JOB_FAILURES failed items, so the cached job stays small
+# however many items it handles, and progress is saved in batches.
+class JobReporter(object):
+    def __init__(self, job):
+        self.job = job
+        self.lock = threading.Lock()
+        self.unsaved = 0
+        self.saved_at = time.time()
+
+    def _save(self):
+        self.job['updated'] = timezone.now()
+        _cache().set(_job_key(self.job['id']), self.job, JOB_TTL)
+        self.unsaved = 0
+        self.saved_at = time.time()
+
+    def set_total(self, total):
+        with self.lock:
+            self.job['total'] = total
+            self._save()
+
+    def progress(self, item, error=None):
+        with self.lock:
+            self.job['done'] += 1
+            if error is None:
+                self.job['succeeded'] += 1
+            else:
+                self.job['failed'] += 1
+                if len(self.job['failures']) < JOB_FAILURES:
+                    self.job['failures'].append((item, str(error)))
+            self.unsaved += 1
+            if self.unsaved >= SAVE_ITEMS or time.time() - self.saved_at >= SAVE_INTERVAL:
+                self._save()
+
+    def finish(self, status, error=None):
+        with self.lock:
+            self.job['status'] = status
+            self.job['error'] = error
+            self._save()
+
+def _run(func, request, reporter, args, kwargs):
+    reporter.finish(STATUS_RUNNING)
+    try:
+        func(request, reporter, *args, **kwargs)
+    except Exception as e:
+        LOG.exception("keymanager job %s failed", reporter.job['id'])
+        reporter.finish(STATUS_FAILED, str(e))
+    else:
+        status = STATUS_FAILED if reporter.job['failed'] else STATUS_FINISHED
+        reporter.finish(status)
+
+def _queue(request, kind, description, func, args, kwargs, listed):
+    now = timezone.now()
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'description': description,
+        'status': STATUS_QUEUED,
+        'total': 0,
+        'done': 0,
+        'succeeded': 0,
+        'failed': 0,
+        'failures': [],
+        'error': None,
+        'created': now,
+        'updated': now,
+    }
+    cache = _cache()
+    cache.set(_job_key(job['id']), job, JOB_TTL)
+    if listed:
+        user_key = _user_key(request.user.id)
+        job_ids = [job['id']] + (cache.get(user_key) or [])
+        cache.set(user_key, job_ids[:JOB_HISTORY], JOB_TTL)
+
+    reporter = JobReporter(job)
+    # jobs outlive the dashboard request, they run on a stand-in for it
+    _executor().submit(_run, func, barbican.ProjectScopedRequest(request), reporter, args, kwargs)
+    LOG.info("keymanager job %s (%s) queued", job['id'], kind)
+    return job['id']
+
+# queue func(request, reporter, *args, **kwargs) on the job pool and return
+# the job id straight away.
+def submit(request, kind, description, func, *args, **kwargs):
+    return _queue(request, kind, description, func, args, kwargs, True)
+
+# same as submit, for housekeeping jobs the user did not ask for: they are
+# kept out of the user's job list
+def submit_unlisted(request, kind, description, func, *args, **kwargs):
+    return _queue(request, kind, description, func, args, kwargs, False)
+
+def get_job(request, job_id):
+    if job_id not in (_cache().get(_user_key(request.user.id)) or []):
+        return None
+    job = _cache().get(_job_key(job_id))
+    return Job(job) if job else None
+
+def list_jobs(request):
+    job_ids = _cache().get(_user_key(request.user.id)) or []
+    jobs = _cache().get_many([_job_key(job_id) for job_id in job_ids])
+    return [Job(jobs[_job_key(job_id)]) for job_id in job_ids
+            if _job_key(job_id) in jobs]
+
+# key-manager operations run as jobs
+def _delete_secrets(request, reporter, secret_refs):
+    reporter.set_total(len(secret_refs))
+    barbican.delete_secrets(request, secret_refs, progress=reporter.progress, background=True)
+
+def _delete_containers(request, reporter, container_refs):
+    reporter.set_total(len(container_refs))
+    barbican.delete_containers(request, container_refs, progress=reporter.progress,
+                              background=True)
+
+def _import_x509pairs(request, reporter, pairs, **kwargs):
+    reporter.set_total(len(pairs))
+    barbican.import_x509pairs(request, pairs, progress=reporter.progress, **kwargs)
+
+def submit_delete_secrets(request, secret_refs):
+    return submit(request, 'delete_secrets', "Delete %d secrets" % len(secret_refs),
+                  _delete_secrets, list(secret_refs))
+
+def submit_delete_containers(request, container_refs):
+    return submit(request, 'delete_containers', "Delete %d containers" % len(container_refs),
+                  _delete_containers, list(container_refs))
+
+def submit_import_x509pairs(request, pairs, **kwargs):
+    return submit(request, 'import', "Import %d certificates" % len(pairs),
+                  _import_x509pairs, pairs, **kwargs)
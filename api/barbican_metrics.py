@@ -0,0 +1,207 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Latency and call-count instrumentation for the barbican API wrapper.
+# Every wrapper call is timed and its HTTP requests counted, both per
+# dashboard request and per process.
+
+import functools
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django import http
+from django.utils import crypto
+from keystoneauth1 import session
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+LOG = logging.getLogger(__name__)
+
+STATS_HEADER = getattr(settings, 'KEYMANAGER_STATS_HEADER', settings.DEBUG)
+STATS_HEADER_NAME = 'X-Keymanager-Stats'
+# scrapers fetch the metrics at METRICS_PATH with an
+# 'Authorization: Bearer <METRICS_TOKEN>' header; unset disables it
+METRICS_TOKEN = getattr(settings, 'KEYMANAGER_METRICS_TOKEN', None)
+METRICS_PATH = getattr(settings, 'KEYMANAGER_METRICS_PATH', '/keymanager/metrics')
+
+_LOCAL = threading.local()
+
+# calls made while serving one dashboard request
+class RequestStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.http_calls = 0
+        self.calls = {}
+
+    def count_http_call(self):
+        with self.lock:
+            self.http_calls += 1
+
+    def record(self, name, duration, size, http_calls, error):
+        with self.lock:
+            entry = self.calls.setdefault(name, {'count': 0, 'duration': 0.0, 'size': 0,
+                                                 'http_calls': 0, 'errors': 0})
+            entry['count'] += 1
+            entry['duration'] += duration
+            entry['size'] += size or 0
+            entry['http_calls'] += http_calls
+            entry['errors'] += 1 if error else 0
+
+    def to_dict(self):
+        with self.lock:
+            return {'http_calls': self.http_calls, 'calls': dict(self.calls)}
+
+# process wide aggregates exported in the prometheus text format
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.functions = {}
+
+    def record(self, name, duration, http_calls, error):
+        with self.lock:
+            entry = self.functions.setdefault(name, {'calls': 0, 'errors': 0,
+                                                     'duration': 0.0, 'http_calls': 0})
+            entry['calls'] += 1
+            entry['errors'] += 1 if error else 0
+            entry['duration'] += duration
+            entry['http_calls'] += http_calls
+
+    def render(self):
+        with self.lock:
+            functions = sorted(self.functions.items())
+        series = (
+            ('keymanager_barbican_calls_total', 'counter', 'Barbican wrapper calls.', 'calls'),
+            ('keymanager_barbican_errors_total', 'counter', 'Barbican wrapper calls that raised.', 'errors'),
+            ('keymanager_barbican_duration_seconds_total', 'counter', 'Time spent in barbican wrapper calls.', 'duration'),
+            ('keymanager_barbican_http_requests_total', 'counter', 'HTTP requests made by barbican wrapper calls, counted on the outermost call only.', 'http_calls'),
+        )
+        lines = []
+        for metric, metric_type, description, field in series:
+            lines.append("# HELP %s %s" % (metric, description))
+            lines.append("# TYPE %s %s" % (metric, metric_type))
+            for name, entry in functions:
+                lines.append('%s{function="%s"} %s' % (metric, name, entry[field]))
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+def request_stats(request):
+    stats = getattr(request, '_keymanager_stats', None)
+    if stats is None:
+        stats = RequestStats()
+        request._keymanager_stats = stats
+    return stats
+
+def current_stats():
+    return getattr(_LOCAL, 'stats', None)
+
+# whether an instrumented call is running, its HTTP requests are already
+# counted there
+def _nested():
+    return getattr(_LOCAL, 'nested', False)
+
+# run func with the stats of the calling thread, used for the calls the
+# wrapper fans out to its worker pools
+def bind_stats(func):
+    stats = current_stats()
+    nested = _nested()
+
+    @functools.wraps(func)
+    def bound(*args, **kwargs):
+        previous = current_stats(), _nested()
+        _LOCAL.stats = stats
+        _LOCAL.nested = nested
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _LOCAL.stats, _LOCAL.nested = previous
+    return bound
+
+# keystone session counting the HTTP requests made on behalf of the
+# current dashboard request
+class CountingSession(session.Session):
+    def request(self, *args, **kwargs):
+        stats = current_stats()
+        if stats is not None:
+            stats.count_http_call()
+        return super(CountingSession, self).request(*args, **kwargs)
+
+def _result_size(result):
+    if isinstance(result, tuple) and result and isinstance(result[0], (list, dict)):
+        result = result[0]
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+# decorator for barbican wrapper functions taking the request as their
+# first argument. Calls made by another instrumented call (e.g. get_secret
+# from get_secret_with_payload) are timed, but their HTTP requests are
+# only counted on the outermost call.
+def instrumented(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(request, *args, **kwargs):
+        stats = request_stats(request)
+        previous = current_stats(), _nested()
+        outermost = not previous[1]
+        _LOCAL.stats = stats
+        _LOCAL.nested = True
+        http_calls = stats.http_calls
+        error = None
+        result = None
+        start = time.time()
+        try:
+            result = func(request, *args, **kwargs)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _LOCAL.stats, _LOCAL.nested = previous
+            duration = time.time() - start
+            http_calls = stats.http_calls - http_calls if outermost else 0
+            stats.record(name, duration, _result_size(result), http_calls, error)
+            METRICS.record(name, duration, http_calls, error)
+            LOG.debug("barbican %s took %.3fs, %d http calls%s", name, duration,
+                      http_calls, " (failed: %s)" % error if error else "")
+    return wrapper
+
+def _bearer_token(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    scheme, _, token = authorization.partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else ''
+
+# answers METRICS_PATH before any view runs, so scrapers holding
+# METRICS_TOKEN get the metrics without a dashboard session
+class KeymanagerMetricsMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        if not METRICS_TOKEN or request.path != METRICS_PATH:
+            return None
+        if not crypto.constant_time_compare(_bearer_token(request), METRICS_TOKEN):
+            return http.HttpResponseForbidden()
+        return http.HttpResponse(METRICS.render(), content_type='text/plain; version=0.0.4')
+
+# adds the per-request barbican statistics as a response header
+class KeymanagerStatsMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        stats = getattr(request, '_keymanager_stats', None)
+        if STATS_HEADER and stats is not None:
+            response[STATS_HEADER_NAME] = json.dumps(stats.to_dict(), sort_keys=True)
+        return response
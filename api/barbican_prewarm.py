@@ -0,0 +1,106 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Cache pre-warming for the key-manager panels. On login and on project
+# switch the barbican client and the listings the index pages start with
+# are fetched in the background, so the first panel visit is served from
+# the cache.
+
+import logging
+import threading
+from concurrent import futures
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from openstack_dashboard.api import barbican
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+LOG = logging.getLogger(__name__)
+
+PREWARM = getattr(settings, 'KEYMANAGER_PREWARM', False)
+PREWARM_CONCURRENCY = getattr(settings, 'KEYMANAGER_PREWARM_CONCURRENCY', 2)
+# warmed listings have to last until the user opens a panel, well past
+# the usual listing TTL
+PREWARM_TTL = getattr(settings, 'KEYMANAGER_PREWARM_TTL', 300)
+SESSION_KEY = 'keymanager_prewarmed_project'
+
+# pre-warms running at once. Requests over the cap are dropped rather
+# than queued, so a login storm never piles up work for barbican.
+_SLOTS = threading.BoundedSemaphore(PREWARM_CONCURRENCY)
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+def _executor():
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = futures.ThreadPoolExecutor(max_workers=PREWARM_CONCURRENCY)
+    return _EXECUTOR
+
+# the first pages both index pages ask for. The fingerprint probes are
+# left cold, so out-of-band changes are not hidden for PREWARM_TTL, and so
+# is the consumer graph, which pages the whole container listing.
+def _warm(request, page_size):
+    try:
+        barbican.get_secrets(request, offset=0, limit=page_size, paginate=True)
+        containers, has_more, has_prev = barbican.get_containers(
+            request, offset=0, limit=page_size, paginate=True)
+        barbican.get_secrets_metadata(request, set(x.get('secret_ref') for c in containers
+                                                   for x in c.get('secret_refs', [])))
+    except Exception as e:
+        LOG.info("keymanager pre-warm of project %s failed: %s", request.user.project_id, e)
+    finally:
+        _SLOTS.release()
+
+# warm the caches of the project the request is scoped to. Returns
+# whether a pre-warm was started.
+def prewarm(request):
+    if not PREWARM:
+        return False
+    if not _SLOTS.acquire(False):
+        LOG.debug("keymanager pre-warm skipped, %d already running", PREWARM_CONCURRENCY)
+        return False
+    try:
+        scoped = barbican.ProjectScopedRequest(request, listing_ttl=PREWARM_TTL)
+        _executor().submit(_warm, scoped, barbican.get_page_size(request))
+    except Exception as e:
+        _SLOTS.release()
+        LOG.info("unable to start the keymanager pre-warm: %s", e)
+        return False
+    request.session[SESSION_KEY] = scoped.user.project_id
+    return True
+
+@receiver(user_logged_in)
+def prewarm_on_login(sender, request, user, **kwargs):
+    prewarm(request)
+
+def _is_authenticated(user):
+    authenticated = getattr(user, 'is_authenticated', False)
+    return authenticated() if callable(authenticated) else authenticated
+
+# starts a pre-warm whenever the project of the session changes. Adding
+# the middleware also connects the login receiver above.
+class KeymanagerPrewarmMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        user = getattr(request, 'user', None)
+        if not PREWARM or user is None or not _is_authenticated(user):
+            return None
+        project_id = getattr(user, 'project_id', None)
+        if project_id and request.session.get(SESSION_KEY) != project_id:
+            prewarm(request)
+        return None
@@ -0,0 +1,74 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# JSON row endpoints feeding the virtualized tables. Every request returns
+# one page of compact rows holding only the fields the tables show, so
+# the response size does not depend on the size of the project.
+
+import logging
+
+from django import http
+
+from openstack_dashboard.api import barbican
+from openstack_dashboard.api import barbican_breaker
+from openstack_dashboard.api import barbican_conditional as conditional
+
+LOG = logging.getLogger(__name__)
+
+# (offset, limit) of the requested page, the limit capped to the barbican
+# result limit
+def page_params(request):
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        offset = 0
+    try:
+        limit = min(max(int(request.GET.get('limit')), 1), barbican.API_LIMIT)
+    except (TypeError, ValueError):
+        limit = barbican.get_page_size(request)
+    return offset, limit
+
+# barbican listing filters given as query parameters
+def listing_filters(request, names):
+    return dict((name, request.GET.get(name)) for name in names if request.GET.get(name))
+
+# 'build' returns (rows, has more data) for the page at (offset, limit).
+# 'extra' values are part of the rows beyond the listings, as for
+# listing_validators.
+def rows_response(request, entities, build, *extra):
+    etag, last_modified = conditional.listing_validators(request, entities, *extra)
+    if conditional.not_modified(request, etag):
+        return conditional.set_validators(http.HttpResponseNotModified(), etag, last_modified)
+
+    offset, limit = page_params(request)
+    try:
+        rows, has_more = build(offset, limit)
+    except barbican_breaker.CircuitOpen:
+        return http.JsonResponse({'error': 'barbican is not responding'}, status=503)
+    except Exception as e:
+        LOG.error("unable to list %s rows: %s", entities[0], e)
+        return http.JsonResponse({'error': 'unable to retrieve the listing'}, status=502)
+
+    response = http.JsonResponse({
+        'rows': rows,
+        'offset': offset,
+        'next_offset': offset + len(rows),
+        'has_more': has_more,
+        'stale': barbican.is_stale(request),
+    })
+    return conditional.set_validators(response, etag, last_modified)
+
+# query string the browse pages hand over to their rows endpoint
+def rows_query(request):
+    params = request.GET.copy()
+    params.pop('offset', None)
+    return params.urlencode()
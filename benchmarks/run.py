@@ -0,0 +1,282 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Benchmarks for the key-manager dashboard data paths.
+#
+# Drives the secrets and secretscontainers index views (including their
+# 304 revalidation) and JSON row endpoints, the container create form and
+# the secret search through the circuit breaker session against an
+# in-process fake barbican at growing object counts, and reports wall
+# time, HTTP requests served by the fake and peak memory. Runs from a
+# horizon tree with the panels installed:
+#
+#   DJANGO_SETTINGS_MODULE=openstack_dashboard.settings \
+#       python benchmarks/run.py --sizes 10,100,1000 --save baseline.json
+#   python benchmarks/run.py --compare baseline.json
+#
+# A comparison run exits with status 1 when a scenario makes more HTTP
+# requests than the baseline or gets slower than the allowed tolerance.
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_barbican
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'openstack_dashboard.settings')
+
+import django
+django.setup()
+
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django import http
+from django.test import RequestFactory
+from django.utils import timezone
+from keystoneauth1 import token_endpoint
+from barbicanclient import client
+
+from openstack_dashboard.api import barbican
+from openstack_dashboard.api import barbican_breaker
+from openstack_dashboard.api import barbican_jobs
+from openstack_dashboard.dashboards.project.secrets import views as secrets_views
+from openstack_dashboard.dashboards.project.secretscontainers import forms as containers_forms
+from openstack_dashboard.dashboards.project.secretscontainers import views as containers_views
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+# keystone token stub: the dashboard user and its token
+class FakeToken(object):
+    id = 'benchmark-token'
+    expires = timezone.now() + datetime.timedelta(days=1)
+
+class FakeUser(object):
+    id = 'benchmark-user'
+    username = 'benchmark'
+    project_id = 'benchmark-project'
+    tenant_id = project_id
+    services_region = 'RegionOne'
+    is_superuser = True
+    is_authenticated = True
+    token = FakeToken()
+
+    def has_perms(self, perm_list, obj=None):
+        return True
+
+    def has_perm(self, perm, obj=None):
+        return True
+
+# CSRF secret of the benchmark browser session, part of the page ETags
+CSRF_SECRET = 'benchmarkbenchmarkbenchmarkbench'
+
+def make_request(path='/', headers=None, **params):
+    request = RequestFactory().get(path, params, **(headers or {}))
+    request.META['CSRF_COOKIE'] = CSRF_SECRET
+    request.user = FakeUser()
+    request.session = {}
+    request._messages = CookieStorage(request)
+    return request
+
+# point the barbican wrapper at the fake server, authenticated by a plain
+# token instead of a keystone scoped one but through the same circuit
+# breaker session as the dashboard
+def use_fake_barbican(server):
+    def build_client(*args, **kwargs):
+        auth = token_endpoint.Token(server.base_url, FakeToken.id)
+        session = barbican_breaker.GuardedSession(
+            auth=auth, breaker=barbican_breaker.get_breaker(server.base_url))
+        return client.Client(session=session, endpoint=server.base_url,
+                             project_id=FakeUser.project_id)
+    barbican._build_client = build_client
+    FakeUser.service_catalog = [{
+        'type': 'key-manager',
+        'name': 'barbican',
+        'endpoints': [{'interface': 'public', 'region': FakeUser.services_region,
+                       'region_id': FakeUser.services_region, 'url': server.base_url}],
+    }]
+
+def reset_caches():
+    barbican_breaker._BREAKERS.clear()
+    barbican._CLIENT_CACHE.clear()
+    barbican._ENDPOINT_CACHE.clear()
+    caches[barbican.LISTING_CACHE_BACKEND].clear()
+
+# wait for the background jobs a scenario queued (the certificate index
+# ones), so they do not hit the fake server while the next one is measured
+def drain_jobs():
+    with barbican_jobs._EXECUTOR_LOCK:
+        executor, barbican_jobs._EXECUTOR = barbican_jobs._EXECUTOR, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+# index views answer through their own get(), so the fingerprint, the 304
+# check and the fingerprinted rows cache are measured too. Only the table
+# is rendered, not the dashboard page around it.
+def table_only(view_class):
+    class TableOnly(view_class):
+        def render_to_response(self, context, **kwargs):
+            return http.HttpResponse(context['table'].render())
+    return TableOnly
+
+INDEX_VIEWS = {
+    'secrets': table_only(secrets_views.IndexView),
+    'containers': table_only(containers_views.IndexView),
+}
+
+def render_index(name, headers=None):
+    return INDEX_VIEWS[name].as_view()(make_request(headers=headers))
+
+def secrets_index():
+    return render_index('secrets')
+
+def containers_index():
+    return render_index('containers')
+
+# a browser reloading an unchanged index page
+def revalidate_index(name):
+    etag = render_index(name).get('ETag')
+    response = render_index(name, {'HTTP_IF_NONE_MATCH': etag})
+    if response.status_code != 304:
+        raise AssertionError("%s index was not revalidated" % name)
+    return response
+
+def secrets_index_revalidate():
+    return revalidate_index('secrets')
+
+def containers_index_revalidate():
+    return revalidate_index('containers')
+
+def container_create_form():
+    request = make_request()
+    return containers_forms.SecretsContainerCreateForm(request).as_p()
+
+def secret_search():
+    return containers_views.SecretSearchView().get(make_request(kind='certificate', q='cert00'))
+
+def secret_rows():
+    return secrets_views.SecretRowsView().get(make_request())
+
+def container_rows():
+    return containers_views.ContainerRowsView().get(make_request())
+
+SCENARIOS = (
+    ('secrets_index', secrets_index),
+    ('containers_index', containers_index),
+    ('secrets_index_revalidate', secrets_index_revalidate),
+    ('containers_index_revalidate', containers_index_revalidate),
+    ('secret_rows', secret_rows),
+    ('container_rows', container_rows),
+    ('container_create_form', container_create_form),
+    ('secret_search', secret_search),
+)
+
+def measure(fake, func):
+    gc.collect()
+    fake.reset_counters()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    func()
+    wall = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    http_requests = fake.request_count
+    drain_jobs()
+    return {'wall': wall, 'http_requests': http_requests, 'peak_memory': peak}
+
+def run(sizes, latency):
+    results = {}
+    for size in sizes:
+        fake = fake_barbican.FakeBarbican(latency=latency)
+        server = fake_barbican.serve(fake)
+        try:
+            fake.populate(size)
+            use_fake_barbican(fake)
+            for name, func in SCENARIOS:
+                reset_caches()
+                results["%s/%d/cold" % (name, size)] = measure(fake, func)
+                results["%s/%d/warm" % (name, size)] = measure(fake, func)
+        finally:
+            server.shutdown()
+            server.server_close()
+    return results
+
+def report(results, baseline=None):
+    print("%-40s %10s %8s %12s" % ("scenario", "wall (s)", "http", "peak (KiB)"))
+    for key in sorted(results):
+        result = results[key]
+        peak = "%d" % (result['peak_memory'] / 1024) if result['peak_memory'] else "-"
+        line = "%-40s %10.3f %8d %12s" % (key, result['wall'], result['http_requests'], peak)
+        if baseline and key in baseline:
+            line += "   (baseline %.3fs, %d http)" % (baseline[key]['wall'], baseline[key]['http_requests'])
+        print(line)
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        if result['http_requests'] > reference['http_requests']:
+            regressions.append("%s: %d http requests, baseline %d"
+                               % (key, result['http_requests'], reference['http_requests']))
+        if result['wall'] > reference['wall'] * (1 + tolerance):
+            regressions.append("%s: %.3fs, baseline %.3fs"
+                               % (key, result['wall'], reference['wall']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="key-manager dashboard benchmarks")
+    parser.add_argument('--sizes', default=",".join(str(x) for x in DEFAULT_SIZES),
+                        help="comma separated container counts (each has two secrets)")
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help="seconds added to every fake barbican response")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed wall time regression over the baseline")
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",") if x]
+    results = run(sizes, args.latency)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION %s" % regression)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
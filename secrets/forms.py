@@ -18,6 +18,8 @@ from horizon import forms
 from horizon import messages
 
 from openstack_dashboard.api import barbican as barbican_bridge
+from openstack_dashboard.api import barbican_jobs
+from openstack_dashboard.dashboards.project.secrets import x509
 
 LOG = logging.getLogger(__name__)
 
@@ -74,15 +76,11 @@ class X509SecretsCreateForm(forms.SelfHandlingForm):
         private_key = data.get('private_key')
 
         try:
-            new_cert_secret = barbican_bridge.create_x509secret(request, name=secretname+"_crt", payload=certificate, algorithm=cipher_suite, bit_length=int(bitlength), mode=mode, secret_type=secret_type)
-            messages.success(request, _('[KEYMANAGER]: Certificate Create Request queued for execution.'))
-            new_cert_secret.store()
-            messages.success(request, _('[KEYMANAGER]: Certificate Successfully Stored'))
-
-            new_key_secret = barbican_bridge.create_x509secret(request, name=secretname+"_key", payload=private_key, algorithm=cipher_suite, bit_length=int(bitlength), mode=mode, secret_type=secret_type)
-            messages.success(request, _('[KEYMANAGER]: Private Key Create Request queued for execution.'))
-            new_key_secret.store()
-            messages.success(request, _('[KEYMANAGER]: Private Key Successfully Stored'))
+            certificate_ref, private_key_ref = barbican_bridge.create_x509pair(request, name=secretname, certificate=certificate, private_key=private_key, algorithm=cipher_suite, bit_length=int(bitlength), mode=mode, secret_type=secret_type)
+            messages.success(request, _('[KEYMANAGER]: Certificate and Private Key Successfully Stored'))
+            if x509.x509 is not None:
+                barbican_bridge.set_certificate_index(request, certificate_ref, x509.certificate_metadata(certificate))
+                barbican_bridge.set_certificate_index(request, private_key_ref, None)
         except:
             exceptions.handle(request, _('[KEYMANAGER]: Error while submitting Certificate or Private Key Create Request.'))
 
@@ -95,17 +93,6 @@ class X509SecretsUpdateForm(forms.SelfHandlingForm):
     secret_type = forms.CharField(widget=forms.HiddenInput())
     payload = forms.CharField(label=_("Payload"), widget=forms.Textarea(), required=True)
 
-    def __init__(self, request, *args, **kwargs):
-        super(X509SecretsUpdateForm, self).__init__(request, *args, **kwargs)
-
-        self.fields['cert_ref'].initial = kwargs.get('initial', {}).get('cert_ref')
-        # get initial value
-        secret = barbican_bridge.get_secret(request, self.fields['cert_ref'].initial)
-
-        self.fields['secret_name'].initial = secret.name
-        self.fields['secret_type'].initial = secret.secret_type
-        self.fields['payload'].initial = secret.payload
-
     def handle(self, request, data):
         LOG.info("secrets::forms::SecretsUpdateForm: RUNNING HTTP POST HOOK")
         user = self.request.user
@@ -122,3 +109,52 @@ class X509SecretsUpdateForm(forms.SelfHandlingForm):
 
         return True
 
+# Key-manager certificate bulk import Django form
+class X509BulkImportForm(forms.SelfHandlingForm):
+    archive = forms.FileField(label=_("Certificate Archive"), required=True,
+                              help_text=_("A tar or zip archive of PEM certificates and private keys, a PEM bundle or a PKCS#12 file"))
+    password = forms.CharField(label=_("PKCS#12 Password"), widget=forms.PasswordInput(render_value=False), required=False)
+    ciphersuite = forms.ChoiceField(choices=X509SecretsCreateForm.CIPHERSUITES, required=True)
+    bitlength = forms.ChoiceField(choices=X509SecretsCreateForm.BITLENGHTS, required=True)
+    cryptomode = forms.ChoiceField(choices=X509SecretsCreateForm.CRYPTOMODES, required=True)
+    create_containers = forms.BooleanField(label=_("Create Certificate Containers"), required=False)
+
+    def __init__(self, request, *args, **kwargs):
+        super(X509BulkImportForm, self).__init__(request, *args, **kwargs)
+
+        self.fields['ciphersuite'].initial = 'aes'
+        self.fields['bitlength'].initial = '256'
+        self.fields['cryptomode'].initial = 'cbc'
+        self.fields['create_containers'].initial = True
+
+    def clean(self):
+        cleaned_data = super(X509BulkImportForm, self).clean()
+        archive = cleaned_data.get('archive')
+        if archive:
+            if archive.size > x509.MAX_UPLOAD_SIZE:
+                raise forms.ValidationError(_("The archive is larger than %d bytes.") % x509.MAX_UPLOAD_SIZE)
+            try:
+                pairs, unmatched = x509.load_x509pairs(archive.name, archive.read(),
+                                                       cleaned_data.get('password'))
+            except x509.X509ImportError as e:
+                raise forms.ValidationError(_("Unable to read the archive: %s") % e)
+            if not pairs:
+                raise forms.ValidationError(_("No matching certificate and private key pairs found."))
+            cleaned_data['pairs'] = pairs
+            cleaned_data['unmatched'] = unmatched
+        return cleaned_data
+
+    def handle(self, request, data):
+        LOG.info("secrets::forms::X509BulkImportForm: RUNNING HTTP POST HOOK")
+        pairs = data.get('pairs')
+
+        for name in data.get('unmatched'):
+            messages.warning(request, _('[KEYMANAGER]: No private key found for certificate %s, skipped.') % name)
+
+        try:
+            barbican_jobs.submit_import_x509pairs(request, pairs, algorithm=data.get("ciphersuite"), bit_length=int(data.get("bitlength")), mode=data.get("cryptomode"), secret_type='opaque', create_containers=data.get('create_containers'))
+            messages.info(request, _('[KEYMANAGER]: Importing %d Certificates in the background.') % len(pairs))
+        except:
+            exceptions.handle(request, _('[KEYMANAGER]: Error while submitting Certificate Import Request.'))
+
+        return True
@@ -12,6 +12,7 @@
 
 import logging
 
+from django import shortcuts
 from django.template import defaultfilters
 from django.core import urlresolvers
 from django.utils.translation import ugettext_lazy as _
@@ -20,6 +21,7 @@ from django.core.urlresolvers import reverse,reverse_lazy, NoReverseMatch
 
 from horizon import tables,exceptions,messages
 from openstack_dashboard.api import barbican as barbican_bridge
+from openstack_dashboard.api import barbican_jobs
 
 LOG = logging.getLogger(__name__)
 
@@ -34,6 +36,91 @@ class X509SecretCreateLink(tables.LinkAction):
     def allowed(self, request, datum):
         return True
 
+# bulk import button link handler
+class X509BulkImportLink(tables.LinkAction):
+    name = "certimport"
+    verbose_name = _("Import X509 Certificates")
+    url = "horizon:project:secrets:certimport"
+    classes = ("ajax-modal",)
+    icon = "upload"
+
+    def allowed(self, request, datum):
+        return True
+
+# inventory export link handler
+class SecretExportLink(tables.LinkAction):
+    name = "export"
+    verbose_name = _("Export CSV")
+    url = "horizon:project:secrets:export"
+    icon = "download"
+
+    def get_link_url(self, datum=None):
+        return "%s?format=csv&certificates=1" % reverse(self.url)
+
+    def allowed(self, request, datum):
+        return True
+
+# virtualized table link handler
+class SecretBrowseLink(tables.LinkAction):
+    name = "browse"
+    verbose_name = _("Browse All")
+    url = "horizon:project:secrets:browse"
+    icon = "list"
+
+    def allowed(self, request, datum):
+        return True
+
+# background jobs page link handler
+class JobsLink(tables.LinkAction):
+    name = "jobs"
+    verbose_name = _("Background Jobs")
+    url = "horizon:project:secrets:jobs"
+    icon = "tasks"
+
+    def allowed(self, request, datum):
+        return True
+
+# domain-wide inventory link handler, administrators only
+class InventoryLink(tables.LinkAction):
+    name = "inventory"
+    verbose_name = _("All Projects")
+    url = "horizon:project:secrets:inventory"
+    icon = "globe"
+
+    def allowed(self, request, datum):
+        return request.user.is_superuser
+
+# show only certificates that expire soon
+class ExpiringSoonLink(tables.LinkAction):
+    name = "expiring"
+    verbose_name = _("Expiring Soon")
+    url = "horizon:project:secrets:index"
+    icon = "clock-o"
+
+    def get_link_url(self, datum=None):
+        return "%s?expiring=1" % reverse(self.url)
+
+    def allowed(self, request, datum):
+        return True
+
+# server side filter. Name, type, algorithm, bit length and creation date
+# are passed on to the barbican listing query, status is matched on the
+# rows of the page.
+class SecretFilterAction(tables.FilterAction):
+    filter_type = "server"
+    filter_choices = (('name', _("Name ="), True),
+                      ('secret_type', _("Type ="), True),
+                      ('alg', _("Algorithm ="), True),
+                      ('bits', _("Bit Length ="), True),
+                      ('created', _("Created (e.g. gte:2017-01-01)"), True),
+                      ('status', _("Status ="), False))
+
+    def filter(self, table, secrets, filter_string):
+        query = filter_string.strip().lower()
+        if table.get_filter_field() != 'status' or not query:
+            return secrets
+        return [x for x in secrets if (x.status or '').lower() == query]
+
 # update certificate
 class X509SecretUpdateLink(tables.LinkAction):
     name = "certupdate"
@@ -86,12 +173,53 @@ class SecretDeleteLink(tables.DeleteAction):
             count
         )
 
+    # secrets still stored in a container can not be deleted
     def allowed(self, request, datum):
-       return True
+        return datum is None or not datum.used_by
 
     def delete(self, request, obj_id):
         barbican_bridge.delete_secret(request, obj_id)
 
+    # delete every selected row in one concurrent batch, large batches are
+    # handed over to a background job
+    def handle(self, table, request, obj_ids):
+        graph = barbican_bridge.get_consumer_graph(request)
+        in_use = [obj_id for obj_id in obj_ids if obj_id in graph]
+        if in_use:
+            messages.error(request, _('[KEYMANAGER]: Entries still stored in a container, not deleted: %s') % ", ".join([obj_id.split("/")[-1] for obj_id in in_use]))
+            obj_ids = [obj_id for obj_id in obj_ids if obj_id not in graph]
+            if not obj_ids:
+                return shortcuts.redirect(self.get_success_url(request))
+
+        if len(obj_ids) > barbican_jobs.JOB_THRESHOLD:
+            barbican_jobs.submit_delete_secrets(request, obj_ids)
+            messages.info(request, _('[KEYMANAGER]: Deleting %d entries in the background.') % len(obj_ids))
+            return shortcuts.redirect(self.get_success_url(request))
+
+        deleted, failed = barbican_bridge.delete_secrets(request, obj_ids)
+        if deleted:
+            messages.success(request, _('[KEYMANAGER]: %d entries deleted.') % len(deleted))
+        if failed:
+            for obj_id, error in failed:
+                LOG.error('Unable to delete secret %s: %s', obj_id, error)
+            failed_ids = ", ".join([obj_id.split("/")[-1] for obj_id, error in failed])
+            messages.error(request, _('[KEYMANAGER]: Unable to delete entries: %s') % failed_ids)
+        return shortcuts.redirect(self.get_success_url(request))
+
+def get_used_by(secret):
+    if secret.used_by:
+        consumers = sum([len(x[2]) for x in secret.used_by])
+        names = ", ".join([x[1] or x[0].split("/")[-1] for x in secret.used_by])
+        return ungettext_lazy(u"%(names)s (%(count)d consumer)",
+                              u"%(names)s (%(count)d consumers)",
+                              consumers) % {'names': names, 'count': consumers}
+    return _("Unused")
+
+def get_certificate_subject(secret):
+    if secret.certificate:
+        return secret.certificate.get('subject')
+    return None
+
 class SecretTable(tables.DataTable):
     id = tables.Column('id', verbose_name=_('ID'), hidden=True)
     secret_ref = tables.Column('secret_ref', link='horizon:project:secrets:secret', verbose_name=_('Secret HREF'))
@@ -101,9 +229,92 @@ class SecretTable(tables.DataTable):
     bit_length = tables.Column('bit_length', verbose_name=_('Bit Length'))
     mode = tables.Column('mode', verbose_name=_('Mode'))
     status = tables.Column('status', verbose_name=_('Status'))
+    used_by = tables.Column(get_used_by, verbose_name=_('Used By'))
+    subject = tables.Column(get_certificate_subject, verbose_name=_('Certificate Subject'))
+    expires_in = tables.Column('expires_in', verbose_name=_('Expires In (days)'), sortable=True)
+
+    page_offset = 0
+    page_size = 0
+
+    def set_page(self, offset, page_size):
+        self.page_offset = offset
+        self.page_size = page_size
+
+    # barbican pages by offset, so the markers are listing offsets
+    def get_marker(self):
+        return str(self.page_offset + len(self.data))
+
+    def get_prev_marker(self):
+        return str(max(self.page_offset - self.page_size, 0))
 
     class Meta(object):
         name = "secrets"
         verbose_name = _("X509 Certificate Management")
-        table_actions = (X509SecretCreateLink, )
+        table_actions = (SecretFilterAction, X509SecretCreateLink, X509BulkImportLink, ExpiringSoonLink, SecretExportLink, SecretBrowseLink, InventoryLink, JobsLink, )
         row_actions = (X509SecretUpdateLink, SecretDeleteLink, )
+
+# inventory export link handler
+class InventoryExportLink(tables.LinkAction):
+    name = "inventoryexport"
+    verbose_name = _("Export NDJSON")
+    url = "horizon:project:secrets:inventoryexport"
+    icon = "download"
+
+    def get_link_url(self, datum=None):
+        return "%s?format=ndjson" % reverse(self.url)
+
+    def allowed(self, request, datum):
+        return True
+
+class InventoryTable(tables.DataTable):
+    id = tables.Column('id', verbose_name=_('ID'), hidden=True)
+    project_name = tables.Column('project_name', verbose_name=_('Project'))
+    project_id = tables.Column('project_id', verbose_name=_('Project ID'), hidden=True)
+    kind = tables.Column('kind', verbose_name=_('Kind'))
+    name = tables.Column('name', verbose_name=_('Name'))
+    type = tables.Column('type', verbose_name=_('Type'))
+    status = tables.Column('status', verbose_name=_('Status'))
+    created = tables.Column('created', verbose_name=_('Created'))
+    ref = tables.Column('ref', verbose_name=_('HREF'))
+
+    class Meta(object):
+        name = "inventory"
+        verbose_name = _("Key Manager Inventory: All Projects")
+        table_actions = (InventoryExportLink, )
+
+def get_job_progress(job):
+    return "%d / %d" % (job.done, job.total)
+
+def get_job_failures(job):
+    failures = ", ".join([item.split("/")[-1] for item, error in job.failures])
+    if job.failed > len(job.failures):
+        failures += _(" and %d more") % (job.failed - len(job.failures))
+    return failures
+
+class UpdateJobRow(tables.Row):
+    ajax = True
+
+    def get_data(self, request, job_id):
+        return barbican_jobs.get_job(request, job_id)
+
+class JobsTable(tables.DataTable):
+    STATUS_CHOICES = (
+        (barbican_jobs.STATUS_QUEUED, None),
+        (barbican_jobs.STATUS_RUNNING, None),
+        (barbican_jobs.STATUS_FINISHED, True),
+        (barbican_jobs.STATUS_FAILED, False),
+    )
+
+    id = tables.Column('id', verbose_name=_('ID'), hidden=True)
+    description = tables.Column('description', verbose_name=_('Job'))
+    created = tables.Column('created', verbose_name=_('Submitted'), filters=(defaultfilters.timesince,))
+    progress = tables.Column(get_job_progress, verbose_name=_('Progress'))
+    failures = tables.Column(get_job_failures, verbose_name=_('Failed Items'))
+    error = tables.Column('error', verbose_name=_('Error'))
+    status = tables.Column('status', verbose_name=_('Status'), status=True, status_choices=STATUS_CHOICES)
+
+    class Meta(object):
+        name = "jobs"
+        verbose_name = _("Background Jobs")
+        status_columns = ["status"]
+        row_class = UpdateJobRow
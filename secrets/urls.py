@@ -18,5 +18,14 @@ urlpatterns = [
     url(r'^$', views.IndexView.as_view(), name='index'),
     url(r'^index$', views.IndexView.as_view(), name='index'),
     url(r'^certificate/create$', views.X509SecretsCreateView.as_view(), name='certcreate'),
+    url(r'^certificate/import$', views.X509BulkImportView.as_view(), name='certimport'),
+    url(r'^export$', views.SecretExportView.as_view(), name='export'),
+    url(r'^inventory$', views.InventoryView.as_view(), name='inventory'),
+    url(r'^inventory/export$', views.InventoryExportView.as_view(), name='inventoryexport'),
+    url(r'^rows$', views.SecretRowsView.as_view(), name='rows'),
+    url(r'^browse$', views.SecretBrowseView.as_view(), name='browse'),
+    url(r'^metrics$', views.MetricsView.as_view(), name='metrics'),
+    url(r'^jobs$', views.JobsView.as_view(), name='jobs'),
+    url(r'^jobs/(?P<job_id>[^/]+)/status$', views.JobStatusView.as_view(), name='jobstatus'),
     url(r'^certificate/(?P<cert_ref>[^/]+)/update$', views.X509SecretsUpdateView.as_view(), name='certupdate'),
 ]
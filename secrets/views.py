@@ -10,39 +10,81 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import datetime
 import logging
 
 from django.core.urlresolvers import reverse,reverse_lazy, NoReverseMatch
+from django import http
 from django.shortcuts import redirect
+from django.views import generic
 from django.utils.translation import ugettext_lazy as _
 from horizon import exceptions
 from horizon import forms
+from horizon import messages
 from horizon import tables
+from horizon import views as horizon_views
+from keystoneauth1 import exceptions as ks_exceptions
+from barbicanclient import exceptions as barbican_exceptions
 
 from openstack_dashboard import settings
 from openstack_dashboard.api import barbican
+from openstack_dashboard.api import barbican_breaker
+from openstack_dashboard.api import barbican_conditional as conditional
+from openstack_dashboard.api import barbican_export as export
+from openstack_dashboard.api import barbican_jobs
+from openstack_dashboard.api import barbican_metrics
+from openstack_dashboard.api import barbican_rows as rows
 from openstack_dashboard.dashboards.project.secrets import tables as secrets_tables
 from openstack_dashboard.dashboards.project.secrets import forms as secrets_forms
+from openstack_dashboard.dashboards.project.secrets import x509
+
+EXPIRY_WARNING_DAYS = getattr(settings, 'KEYMANAGER_EXPIRY_WARNING_DAYS', 30)
 
 LOG = logging.getLogger(__name__)
 
-class SecretData(object):
-    def __init__(self, secret_object):
-        self.secret_object = secret_object
-        self.secret_object_dict = self.secret_object.__dict__
-        for k in self.secret_object_dict:
-            setattr(self, k, self.secret_object_dict.get(k))
-
-        # map HREF to id
-        self.id = self.secret_object.secret_ref
-        self.secret_ref = self.id
-        self.name = self.secret_object.name
-        self.expiration = self.secret_object.expiration
-        self.algorithm = self.secret_object.algorithm
-        self.bit_length = self.secret_object.bit_length
-        self.secret_type = self.secret_object.secret_type
-        self.status = self.secret_object.status
-        self.mode = self.secret_object.mode
+# secrets that hold a certificate: barbican certificates and the opaque
+# <name>_crt secrets uploaded by this panel. Nothing else is decrypted for
+# the expiry index.
+def is_certificate_candidate(secret):
+    if secret.get('secret_type') == 'certificate':
+        return True
+    return (secret.get('name') or '').endswith('_crt')
+
+# errors worth another decrypt once the index claim expires: barbican
+# being unavailable or the token having expired. Any other error (e.g. an
+# ACL refusal or an undecodable payload) will fail the same way next time.
+RETRIED_INDEX_ERRORS = barbican_breaker.OUTAGE_ERRORS + (ks_exceptions.Unauthorized,
+                                                         barbican_exceptions.HTTPAuthError)
+
+# background job: decrypt and parse the payload of every secret in
+# secret_refs and record the result in the certificate index
+def index_certificates(request, reporter, secret_refs):
+    reporter.set_total(len(secret_refs))
+    for secret_ref in secret_refs:
+        try:
+            payload = barbican.get_secret_payload(request, secret_ref)
+            barbican.set_certificate_index(request, secret_ref, x509.certificate_metadata(payload))
+        except RETRIED_INDEX_ERRORS as e:
+            reporter.progress(secret_ref, e)
+        except Exception as e:
+            barbican.set_certificate_index(request, secret_ref, None, error=str(e))
+            reporter.progress(secret_ref, e)
+        else:
+            reporter.progress(secret_ref)
+
+# attach indexed certificate metadata to secret listing entries, indexing
+# the ones never seen before in the background. Index jobs are internal,
+# they are not listed on the user's Background Jobs page.
+def get_certificates(request, secrets):
+    candidates = [x.get('secret_ref') for x in secrets if is_certificate_candidate(x)]
+    index = barbican.get_certificate_index(request, candidates)
+    if x509.x509 is None:
+        return index
+    missing = barbican.claim_certificate_index([ref for ref in candidates if ref not in index])
+    if missing:
+        barbican_jobs.submit_unlisted(request, 'x509_index', "Index %d certificates" % len(missing),
+                                      index_certificates, missing)
+    return index
 
 class X509SecretsCreateView(forms.ModalFormView):
     template_name = 'project/secrets/create.html'
@@ -54,6 +96,16 @@ class X509SecretsCreateView(forms.ModalFormView):
     success_url = reverse_lazy('horizon:project:secrets:index')
     page_title = _("Add new Certificate")
 
+class X509BulkImportView(forms.ModalFormView):
+    template_name = 'project/secrets/bulkimport.html'
+    modal_header = _("Import X509 Certificates")
+    form_id = "x509_bulk_import_form"
+    form_class = secrets_forms.X509BulkImportForm
+    submit_label = _("Import Certificates")
+    submit_url = reverse_lazy("horizon:project:secrets:certimport")
+    success_url = reverse_lazy('horizon:project:secrets:index')
+    page_title = _("Import Certificates")
+
 class X509SecretsUpdateView(forms.ModalFormView):
     template_name = 'project/secrets/update.html'
     modal_header = _("Update Certificate Payload")
@@ -73,8 +125,21 @@ class X509SecretsUpdateView(forms.ModalFormView):
         LOG.info("Certificate Update View: updated context %s" % context)
         return context
 
+    # the current secret is only loaded to render the form, a POST carries
+    # everything update_x509secret needs
     def get_initial(self):
-        return {'cert_ref': self.kwargs['cert_ref'],}
+        initial = {'cert_ref': self.kwargs['cert_ref'],}
+        if self.request.method == 'GET':
+            try:
+                secret = barbican.get_secret_with_payload(self.request, self.kwargs['cert_ref'])
+                initial.update({
+                    'secret_name': secret['name'],
+                    'secret_type': secret['secret_type'],
+                    'payload': secret['payload'],
+                })
+            except:
+                exceptions.handle(self.request, _('[KEYMANAGER]: Unable to retrieve the Certificate.'))
+        return initial
 
 class IndexView(tables.DataTableView):
     table_class = secrets_tables.SecretTable
@@ -85,12 +150,259 @@ class IndexView(tables.DataTableView):
         context = super(IndexView, self).get_context_data(**kwargs)
         return context
 
+    def has_more_data(self, table):
+        return self._more
+
+    def has_prev_data(self, table):
+        return self._prev
+
+    # pagination markers carry the barbican listing offset
+    def get_offset(self):
+        meta = self.table._meta
+        offset = (self.request.GET.get(meta.prev_pagination_param) or
+                  self.request.GET.get(meta.pagination_param))
+        try:
+            return max(int(offset), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    etag = None
+
+    # the listing fingerprint is checked before anything is built: an
+    # unchanged page is answered with a 304, and rows already built for the
+    # same fingerprint are reused. The day is part of the etag since the
+    # remaining validity of the certificates is shown in days.
+    def get(self, request, *args, **kwargs):
+        last_modified = None
+        if request.method == 'GET':
+            table = self.get_table()
+            self.etag, last_modified = conditional.listing_validators(
+                request, ('secrets', 'containers'), datetime.date.today(),
+                barbican.get_page_size(request),
+                table.get_filter_field(), table.get_filter_string())
+        if conditional.not_modified(request, self.etag):
+            response = http.HttpResponseNotModified()
+        else:
+            response = super(IndexView, self).get(request, *args, **kwargs)
+        return conditional.set_validators(response, self.etag, last_modified)
+
+    def build_rows(self, offset, page_size, expiring, filters):
+        more = prev = False
+        if expiring:
+            # expiring certificates are searched among the first
+            # API_RESULT_LIMIT secrets of the listing, not a single page
+            secrets = barbican.get_secrets(self.request, **filters)
+        else:
+            secrets, more, prev = barbican.get_secrets(
+                self.request, offset=offset, limit=page_size, paginate=True, **filters)
+        certificates = get_certificates(self.request, secrets)
+        graph = barbican.get_consumer_graph(self.request)
+        objects = [barbican.SecretRow.from_listing(
+                       secret, certificates.get(secret.get('secret_ref')),
+                       graph.get(secret.get('secret_ref'), ()))
+                   for secret in secrets]
+
+        if expiring:
+            objects = [x for x in objects
+                       if x.expires_in is not None and x.expires_in <= EXPIRY_WARNING_DAYS]
+            objects.sort(key=lambda x: x.expires_in)
+        return objects, more, prev
+
     def get_data(self):
-        objects = []
+        self._more = self._prev = False
+        offset = self.get_offset()
+        page_size = barbican.get_page_size(self.request)
+        expiring = self.request.GET.get('expiring')
+        filters = self.get_filters()
+
+        def build():
+            return self.build_rows(offset, page_size, expiring, filters)
+
         try:
-            for secret_object in barbican.get_secrets(self.request):
-                objects.append(SecretData(secret_object))
-        except:
+            if self.etag:
+                objects, self._more, self._prev = barbican.get_fingerprinted_rows(
+                    self.request, self.etag, build)
+            else:
+                objects, self._more, self._prev = build()
+        except barbican_breaker.CircuitOpen:
+            messages.warning(self.request, _('[KEYMANAGER]: Barbican is not responding, try again later.'))
+            objects = []
+        except Exception as e:
+            LOG.error("unable to list secrets: %s", e)
+            messages.error(self.request, _('[KEYMANAGER]: Unable to retrieve the secret list.'))
             objects = []
-    
+
+        if barbican.is_stale(self.request):
+            messages.warning(self.request, _('[KEYMANAGER]: Barbican is not responding, showing the last known secrets.'))
+
+        self.table.set_page(offset, page_size)
         return objects
+
+SECRET_ROW_FIELDS = ('secret_ref', 'name', 'secret_type', 'algorithm', 'bit_length',
+                     'mode', 'status', 'expiration', 'created', 'expires_in')
+SECRET_ROW_FILTERS = ('name', 'secret_type', 'alg', 'bits', 'created')
+
+SECRET_BROWSE_COLUMNS = (
+    ('name', _('Name')),
+    ('secret_type', _('Type')),
+    ('algorithm', _('Algorithm')),
+    ('bit_length', _('Bit Length')),
+    ('status', _('Status')),
+    ('used_by', _('Used By')),
+    ('subject', _('Certificate Subject')),
+    ('expires_in', _('Expires In (days)')),
+    ('created', _('Created')),
+)
+
+# one page of secret rows as JSON, for the virtualized table
+class SecretRowsView(generic.View):
+    def get(self, request):
+        filters = rows.listing_filters(request, SECRET_ROW_FILTERS)
+
+        def build(offset, limit):
+            secrets, has_more, has_prev = barbican.get_secrets(
+                request, offset=offset, limit=limit, paginate=True, **filters)
+            certificates = get_certificates(request, secrets)
+            graph = barbican.get_consumer_graph(request)
+            results = []
+            for secret in secrets:
+                row = barbican.SecretRow.from_listing(
+                    secret, certificates.get(secret.get('secret_ref')),
+                    graph.get(secret.get('secret_ref'), ()))
+                data = row.to_dict(SECRET_ROW_FIELDS)
+                data['subject'] = secrets_tables.get_certificate_subject(row)
+                data['used_by'] = [x[1] or x[0].split("/")[-1] for x in row.used_by]
+                results.append(data)
+            return results, has_more
+
+        # expires_in is counted in days, so the day is part of the etag
+        return rows.rows_response(request, ('secrets', 'containers'), build,
+                                  datetime.date.today())
+
+# virtualized secret table, rendering only the rows in view
+class SecretBrowseView(horizon_views.HorizonTemplateView):
+    template_name = 'project/secrets/browse.html'
+    page_title = _("Browse Secrets")
+
+    def get_context_data(self, **kwargs):
+        context = super(SecretBrowseView, self).get_context_data(**kwargs)
+        context['table_id'] = "secrets_browse"
+        context['rows_url'] = "%s?%s" % (reverse('horizon:project:secrets:rows'),
+                                         rows.rows_query(self.request))
+        context['columns'] = SECRET_BROWSE_COLUMNS
+        return context
+
+class JobsView(tables.DataTableView):
+    table_class = secrets_tables.JobsTable
+    template_name = 'project/secrets/jobs.html'
+    page_title = _("Key Manager Background Jobs")
+
+    def get_data(self):
+        return barbican_jobs.list_jobs(self.request)
+
+class JobStatusView(generic.View):
+    def get(self, request, job_id):
+        job = barbican_jobs.get_job(request, job_id)
+        if job is None:
+            raise http.Http404()
+        return http.JsonResponse(job.to_dict())
+
+# process wide barbican wrapper metrics in the prometheus text format
+class MetricsView(generic.View):
+    def get(self, request):
+        if not request.user.is_superuser:
+            raise http.Http404()
+        return http.HttpResponse(barbican_metrics.METRICS.render(),
+                                 content_type='text/plain; version=0.0.4')
+
+# domain-wide inventory of the secrets and containers of every project the
+# administrator has a role on. Projects are listed concurrently, the table
+# is complete once the slowest project has answered.
+class InventoryView(tables.DataTableView):
+    table_class = secrets_tables.InventoryTable
+    template_name = 'project/secrets/inventory.html'
+    page_title = _("Key Manager Inventory")
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            raise http.Http404()
+        return super(InventoryView, self).get(request, *args, **kwargs)
+
+    def get_data(self):
+        try:
+            projects = barbican.get_inventory_projects(self.request)
+        except:
+            exceptions.handle(self.request, _('[KEYMANAGER]: Unable to retrieve the project list.'))
+            return []
+
+        objects = []
+        failed = set()
+        for project, entity, entries, error in barbican.iter_inventory(self.request, projects):
+            if error is not None:
+                failed.add(project.name)
+                continue
+            objects.extend(barbican.InventoryRow.from_listing(project, entity, x) for x in entries)
+        if failed:
+            messages.warning(self.request, _('[KEYMANAGER]: Unable to list projects: %s') % ", ".join(sorted(failed)))
+        objects.sort(key=lambda x: (x.project_name, x.kind, x.name or ''))
+        return objects
+
+INVENTORY_EXPORT_FIELDS = ('project_id', 'project_name', 'kind', 'ref', 'name', 'type',
+                           'status', 'created', 'updated')
+
+# stream the domain-wide inventory, every project's rows are written as
+# soon as its listing completes
+class InventoryExportView(generic.View):
+    def get(self, request):
+        if not request.user.is_superuser:
+            raise http.Http404()
+        export_format = export.export_format(request)
+        if export_format is None:
+            return http.HttpResponseBadRequest()
+        try:
+            projects = barbican.get_inventory_projects(request)
+        except:
+            exceptions.handle(request, ignore=True)
+            return http.HttpResponse(status=503)
+        return export.export_response(self.rows(request, projects), INVENTORY_EXPORT_FIELDS,
+                                      export_format, "inventory")
+
+    def rows(self, request, projects):
+        for project, entity, entries, error in barbican.iter_inventory(request, projects):
+            if error is not None:
+                yield {'project_id': project.id, 'project_name': project.name,
+                       'kind': entity.rstrip('s'), 'status': 'ERROR'}
+                continue
+            for entry in entries:
+                row = barbican.InventoryRow.from_listing(project, entity, entry)
+                yield dict((field, getattr(row, field)) for field in INVENTORY_EXPORT_FIELDS)
+
+SECRET_EXPORT_FIELDS = ('secret_ref', 'name', 'secret_type', 'algorithm', 'bit_length',
+                        'mode', 'status', 'expiration', 'created', 'updated')
+
+# stream the whole secret inventory of the project, optionally with the
+# parsed certificate fields of the certificate index
+class SecretExportView(generic.View):
+    def get(self, request):
+        export_format = export.export_format(request)
+        if export_format is None:
+            return http.HttpResponseBadRequest()
+        with_certificates = bool(request.GET.get('certificates'))
+        fields = SECRET_EXPORT_FIELDS
+        if with_certificates:
+            fields += export.CERTIFICATE_FIELDS
+        return export.export_response(self.rows(request, with_certificates), fields,
+                                      export_format, "secrets")
+
+    def rows(self, request, with_certificates):
+        # exports page barbican with the largest page it accepts, not the
+        # page size of the tables
+        for page in export.chunks(barbican.iter_secrets(request), barbican.API_LIMIT):
+            index = {}
+            if with_certificates:
+                index = barbican.get_certificate_index(request, [x.get('secret_ref') for x in page])
+            for secret in page:
+                row = dict((field, secret.get(field)) for field in SECRET_EXPORT_FIELDS)
+                if with_certificates:
+                    row.update(index.get(secret.get('secret_ref')) or {})
+                yield row
@@ -0,0 +1,333 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# X509 helpers: archive unpacking, PEM splitting, PKCS#12 decoding and
+# certificate/private key pairing for the bulk import, certificate metadata
+# extraction for the expiry index.
+
+import binascii
+import collections
+import io
+import logging
+import os
+import re
+import tarfile
+import zipfile
+
+# the cryptography package is optional: without it PKCS#12 bundles are
+# rejected, certificates are paired with keys by file name only and the
+# expiry index stays empty.
+try:
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import dsa, ec, rsa
+except ImportError:
+    x509 = None
+
+LOG = logging.getLogger(__name__)
+
+MAX_UPLOAD_SIZE = 16 * 1024 * 1024
+MAX_ARCHIVE_MEMBERS = 2000
+MAX_MEMBER_SIZE = 1024 * 1024
+MAX_ARCHIVE_SIZE = 64 * 1024 * 1024
+
+PKCS12_EXTENSIONS = ('.p12', '.pfx')
+
+PEM_BLOCK = re.compile(r'-----BEGIN ([A-Z0-9 ]+)-----.+?-----END \1-----', re.DOTALL)
+CERTIFICATE_BLOCKS = ('CERTIFICATE', 'TRUSTED CERTIFICATE')
+PRIVATE_KEY_BLOCKS = ('PRIVATE KEY', 'RSA PRIVATE KEY', 'EC PRIVATE KEY', 'ENCRYPTED PRIVATE KEY')
+
+class X509ImportError(ValueError):
+    pass
+
+def _stem(filename):
+    name = os.path.basename(filename)
+    for ext in ('.crt', '.cert', '.cer', '.key', '.pem') + PKCS12_EXTENSIONS:
+        if name.lower().endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+# member path without its extension, e.g. 'a/site' for './a/site.crt'
+def _path_stem(filename):
+    path = os.path.normpath(filename).lstrip('/')
+    return os.path.join(os.path.dirname(path), _stem(path))
+
+# unpack a tar/zip archive into a list of (member name, bytes). Anything
+# else is returned as a single member named after the upload. The number
+# of members and their total unpacked size are capped.
+def read_archive(filename, data):
+    buf = io.BytesIO(data)
+    members = []
+    sizes = [0]
+
+    def add(name, size, read):
+        if len(members) >= MAX_ARCHIVE_MEMBERS:
+            raise X509ImportError("archive holds more than %d files" % MAX_ARCHIVE_MEMBERS)
+        sizes[0] += size
+        if sizes[0] > MAX_ARCHIVE_SIZE:
+            raise X509ImportError("archive unpacks to more than %d bytes" % MAX_ARCHIVE_SIZE)
+        members.append((name, read()))
+
+    if zipfile.is_zipfile(buf):
+        with zipfile.ZipFile(buf) as archive:
+            for info in archive.infolist():
+                if info.filename.endswith('/') or info.file_size > MAX_MEMBER_SIZE:
+                    continue
+                add(info.filename, info.file_size, lambda: archive.read(info))
+    else:
+        buf.seek(0)
+        try:
+            archive = tarfile.open(fileobj=buf, mode='r:*')
+        except tarfile.TarError:
+            return [(filename, data)]
+        with archive:
+            for info in archive:
+                if not info.isfile() or info.size > MAX_MEMBER_SIZE:
+                    continue
+                add(info.name, info.size, lambda: archive.extractfile(info).read())
+    return members
+
+# ('certificate' or 'key', pem) of the blocks of a PEM document, in order
+def pem_blocks(data):
+    text = data.decode('ascii', 'ignore') if isinstance(data, bytes) else data
+    blocks = []
+    for match in PEM_BLOCK.finditer(text):
+        if match.group(1) in CERTIFICATE_BLOCKS:
+            blocks.append(('certificate', match.group(0) + "\n"))
+        elif match.group(1) in PRIVATE_KEY_BLOCKS:
+            blocks.append(('key', match.group(0) + "\n"))
+    return blocks
+
+# return (certificate blocks, private key blocks) found in a PEM document
+def split_pem(data):
+    blocks = pem_blocks(data)
+    return ([pem for kind, pem in blocks if kind == 'certificate'],
+            [pem for kind, pem in blocks if kind == 'key'])
+
+# decode a PKCS#12 bundle into (certificate chain pem, private key pem)
+def read_pkcs12(data, password=None):
+    if x509 is None:
+        raise X509ImportError("PKCS#12 bundles require the cryptography package")
+    from cryptography.hazmat.primitives.serialization import pkcs12
+
+    if password:
+        password = password.encode('utf-8')
+    try:
+        key, certificate, chain = pkcs12.load_key_and_certificates(data, password or None,
+                                                                   default_backend())
+    except ValueError as e:
+        raise X509ImportError("unable to decode PKCS#12 bundle: %s" % e)
+    if key is None or certificate is None:
+        raise X509ImportError("PKCS#12 bundle does not hold a certificate and a private key")
+
+    pem_chain = [c.public_bytes(serialization.Encoding.PEM).decode('ascii')
+                 for c in [certificate] + list(chain or [])]
+    pem_key = key.private_bytes(serialization.Encoding.PEM,
+                                serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption()).decode('ascii')
+    return "".join(pem_chain), pem_key
+
+def _public_key_id(pem, is_key):
+    try:
+        if is_key:
+            obj = serialization.load_pem_private_key(pem.encode('ascii'), None, default_backend())
+            public_key = obj.public_key()
+        else:
+            public_key = x509.load_pem_x509_certificate(pem.encode('ascii'),
+                                                        default_backend()).public_key()
+        return public_key.public_bytes(serialization.Encoding.DER,
+                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+    except (ValueError, TypeError):
+        return None
+
+# CA certificates (or self-signed ones) are chain material, never leaves
+def _is_ca(pem):
+    try:
+        certificate = x509.load_pem_x509_certificate(pem.encode('ascii'), default_backend())
+    except ValueError:
+        return False
+    try:
+        if certificate.extensions.get_extension_for_class(x509.BasicConstraints).value.ca:
+            return True
+    except x509.ExtensionNotFound:
+        pass
+    return certificate.issuer == certificate.subject
+
+# pair on the public key. Every certificate a key of the upload belongs
+# to is a leaf; CA certificates of the same document form the chain of
+# the leaf they follow, any other certificate is reported unmatched.
+def _match_by_public_key(documents):
+    keys_by_id = {}
+    for member, blocks in documents:
+        for kind, pem in blocks:
+            key_id = _public_key_id(pem, True) if kind == 'key' else None
+            if key_id is not None:
+                keys_by_id.setdefault(key_id, pem)
+
+    pairs = []
+    unmatched = []
+    for member, blocks in documents:
+        leaves = []
+        orphans = []
+        for kind, pem in blocks:
+            if kind != 'certificate':
+                continue
+            key = keys_by_id.get(_public_key_id(pem, False))
+            if key is not None:
+                leaves.append((pem, key, orphans if not leaves else []))
+            elif _is_ca(pem):
+                (leaves[-1][2] if leaves else orphans).append(pem)
+            else:
+                unmatched.append(member)
+        if not leaves and orphans:
+            unmatched.append(member)
+        for leaf, key, chain in leaves:
+            pairs.append((member, leaf + "".join(chain), key))
+    return pairs, unmatched
+
+# split a PEM document in (certificates, key) groups following the block
+# order: a key belongs to the certificates right before it, or right
+# after it when the document starts with a key
+def _order_groups(blocks):
+    groups = []
+    certificates = []
+    key = None
+    for kind, pem in blocks:
+        if kind == 'certificate':
+            certificates.append(pem)
+        elif key is None and certificates:
+            groups.append((certificates, pem))
+            certificates = []
+        else:
+            if key is not None:
+                groups.append((certificates, key))
+                certificates = []
+            key = pem
+    if certificates or key is not None:
+        groups.append((certificates, key))
+    return groups
+
+# pair without cryptography: by block order inside a PEM document, or with
+# the key file of the same path (a/site.crt and a/site.key)
+def _match_by_order(documents):
+    key_files = {}
+    pending = collections.defaultdict(list)
+    pairs = []
+    unmatched = []
+    for member, blocks in documents:
+        if all(kind == 'key' for kind, pem in blocks):
+            key_files.setdefault(_path_stem(member), []).extend(pem for kind, pem in blocks)
+            continue
+        for certificates, key in _order_groups(blocks):
+            if not certificates:
+                continue
+            if key is None:
+                pending[_path_stem(member)].append((member, "".join(certificates)))
+            else:
+                pairs.append((member, "".join(certificates), key))
+
+    for path, groups in pending.items():
+        keys = key_files.get(path, [])
+        if len(groups) == 1 and len(keys) == 1:
+            pairs.append((groups[0][0], groups[0][1], keys[0]))
+        else:
+            unmatched.extend(member for member, certificates in groups)
+    return pairs, unmatched
+
+# name each pair after its file. Names found in several directories get
+# the directory prepended, names still taken get a numeric suffix.
+def _unique_names(pairs):
+    paths = set(_path_stem(member) for member, certificate, key in pairs)
+    stems = collections.Counter(_stem(path) for path in paths)
+    named = []
+    used = set()
+    for member, certificate, key in pairs:
+        name = _stem(member)
+        if stems[name] > 1:
+            name = _path_stem(member).replace('/', '_')
+        base = name
+        suffix = 2
+        while name in used:
+            name = "%s-%d" % (base, suffix)
+            suffix += 1
+        used.add(name)
+        named.append((name, certificate, key))
+    return named
+
+# turn an uploaded file into ([(name, certificate pem, key pem)], names
+# of the certificates left without a key)
+def load_x509pairs(filename, data, password=None):
+    if filename.lower().endswith(PKCS12_EXTENSIONS):
+        certificate, key = read_pkcs12(data, password)
+        return [(_stem(filename), certificate, key)], []
+
+    documents = []
+    for member, content in read_archive(filename, data):
+        if member.lower().endswith(PKCS12_EXTENSIONS):
+            certificate, key = read_pkcs12(content, password)
+            documents.append((member, [('key', key)] +
+                              [('certificate', pem) for pem in split_pem(certificate)[0]]))
+            continue
+        blocks = pem_blocks(content)
+        if blocks:
+            documents.append((member, blocks))
+
+    if not any(kind == 'certificate' for member, blocks in documents for kind, pem in blocks):
+        raise X509ImportError("no certificates found in %s" % filename)
+    if x509 is not None:
+        pairs, unmatched = _match_by_public_key(documents)
+    else:
+        pairs, unmatched = _match_by_order(documents)
+    return _unique_names(pairs), unmatched
+
+def _key_type(public_key):
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return 'RSA'
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return 'EC'
+    if isinstance(public_key, dsa.DSAPublicKey):
+        return 'DSA'
+    return public_key.__class__.__name__
+
+# parsed metadata of the leaf certificate in a PEM payload, None when the
+# payload does not hold a certificate.
+def certificate_metadata(payload):
+    if x509 is None:
+        return None
+    certificates = split_pem(payload)[0]
+    if not certificates:
+        return None
+    try:
+        certificate = x509.load_pem_x509_certificate(certificates[0].encode('ascii'),
+                                                     default_backend())
+    except ValueError:
+        return None
+
+    try:
+        san = certificate.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+        sans = [str(name.value) for name in san.value]
+    except x509.ExtensionNotFound:
+        sans = []
+
+    public_key = certificate.public_key()
+    return {
+        'subject': certificate.subject.rfc4514_string(),
+        'issuer': certificate.issuer.rfc4514_string(),
+        'sans': sans,
+        'not_before': certificate.not_valid_before,
+        'not_after': certificate.not_valid_after,
+        'key_type': _key_type(public_key),
+        'key_size': getattr(public_key, 'key_size', None),
+        'fingerprint': binascii.hexlify(certificate.fingerprint(hashes.SHA256())).decode('ascii'),
+    }
@@ -11,7 +11,9 @@
 # under the License.
 
 import logging
+import re
 
+from django.core.urlresolvers import reverse_lazy
 from django.utils.translation import ugettext_lazy as _
 from horizon import exceptions
 from horizon import forms
@@ -21,25 +23,28 @@ from openstack_dashboard.api import barbican as barbican_bridge
 
 LOG = logging.getLogger(__name__)
 
+SECRET_ID = re.compile(r'^[0-9a-fA-F-]{32,36}$')
+
+def secret_picker(kind):
+    return forms.TextInput(attrs={
+        'data-secret-search': reverse_lazy('horizon:project:secretscontainers:secretsearch'),
+        'data-secret-kind': kind,
+        'autocomplete': 'off',
+        'list': 'secret_search_%s' % kind,
+    })
+
 # Key-manager container create Django form
 class SecretsContainerCreateForm(forms.SelfHandlingForm):
     containername = forms.CharField(max_length=255, label=_("Container Name"), required=True)
     containertype = forms.CharField(widget=forms.HiddenInput())
-    certificate_object = forms.ThemableChoiceField(label=_("Select Certificate"), help_text=_("X509 Certificate ID from Openstack Keymanager"))
-    pk_object = forms.ThemableChoiceField(label=_("Select Private Key"), help_text=_("Private Key ID from Openstack Keymanager"))
+    certificate_object = forms.RegexField(regex=SECRET_ID, label=_("Select Certificate"), widget=secret_picker('certificate'), help_text=_("Type to search X509 Certificates stored in Openstack Keymanager"))
+    pk_object = forms.RegexField(regex=SECRET_ID, label=_("Select Private Key"), widget=secret_picker('private_key'), help_text=_("Type to search Private Keys stored in Openstack Keymanager"))
 
     def __init__(self, request, *args, **kwargs):
         super(SecretsContainerCreateForm, self).__init__(request, *args, **kwargs)
 
-        # retrieve a list of stored secrets
-        secrets_list = barbican_bridge.get_secrets(request)
-        certificate_choices = [ (x.secret_ref.split("/")[-1], x.name) for x in secrets_list ]
-        pk_choices = [ (x.secret_ref.split("/")[-1], x.name) for x in secrets_list ]
-
         self.fields['containername'].initial = "SSL Container"
         self.fields['containertype'].initial = 'certificate'
-        self.fields['certificate_object'].choices = certificate_choices
-        self.fields['pk_object'].choices = pk_choices
 
     def handle(self, request, data):
         LOG.info("secretscontainers::forms::SecretsContainerCreateForm: RUNNING HTTP POST HOOK")
@@ -54,9 +59,7 @@ class SecretsContainerCreateForm(forms.SelfHandlingForm):
         pk = barbican_bridge.get_secret(request, pkref)
 
         try:
-            new_container = barbican_bridge.create_container(request, name=name, certificate=cert, private_key=pk)
-            messages.success(request, _('[KEYMANAGER]: Container Create Request queued for execution.'))
-            new_container.store()
+            barbican_bridge.create_container(request, name=name, certificate=cert, private_key=pk)
             messages.success(request, _('[KEYMANAGER]: Container Stored.'))
         except:
             exceptions.handle(request, _('[KEYMANAGER]: Error while submitting Container Create Request.'))
@@ -11,9 +11,11 @@
 # under the License.
 
 import logging
-import uuid
 
-from django.template import defaultfilters, loader
+from django import shortcuts
+from django.template import defaultfilters
+from django.utils.html import escape, format_html, format_html_join
+from django.utils.safestring import mark_safe
 from django.core import urlresolvers
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ungettext_lazy
@@ -21,6 +23,7 @@ from django.core.urlresolvers import reverse,reverse_lazy, NoReverseMatch
 
 from horizon import tables,exceptions,messages
 from openstack_dashboard.api import barbican as barbican_bridge
+from openstack_dashboard.api import barbican_jobs
 
 LOG = logging.getLogger(__name__)
 
@@ -35,6 +38,43 @@ class ContainerCreateLink(tables.LinkAction):
     def allowed(self, request, datum):
         return True
 
+# inventory export link handler
+class ContainerExportLink(tables.LinkAction):
+    name = "export"
+    verbose_name = _("Export CSV")
+    url = "horizon:project:secretscontainers:export"
+    icon = "download"
+
+    def get_link_url(self, datum=None):
+        return "%s?format=csv" % reverse(self.url)
+
+    def allowed(self, request, datum):
+        return True
+
+# server side filter. Name and type are passed on to the barbican listing
+# query, status is matched on the rows of the page.
+class ContainerFilterAction(tables.FilterAction):
+    filter_type = "server"
+    filter_choices = (('name', _("Name ="), True),
+                      ('type', _("Type ="), True),
+                      ('status', _("Status ="), False))
+
+    def filter(self, table, containers, filter_string):
+        query = filter_string.strip().lower()
+        if table.get_filter_field() != 'status' or not query:
+            return containers
+        return [x for x in containers if (x.status or '').lower() == query]
+
+# virtualized table link handler
+class ContainerBrowseLink(tables.LinkAction):
+    name = "browse"
+    verbose_name = _("Browse All")
+    url = "horizon:project:secretscontainers:browse"
+    icon = "list"
+
+    def allowed(self, request, datum):
+        return True
+
 # container delete button link handler
 class ContainerDeleteLink(tables.DeleteAction):
     name = "containerdelete"
@@ -62,43 +102,62 @@ class ContainerDeleteLink(tables.DeleteAction):
     def delete(self, request, obj_id):
        barbican_bridge.delete_container(request, obj_id)
 
+    # delete every selected row in one concurrent batch, large batches are
+    # handed over to a background job
+    def handle(self, table, request, obj_ids):
+        if len(obj_ids) > barbican_jobs.JOB_THRESHOLD:
+            barbican_jobs.submit_delete_containers(request, obj_ids)
+            messages.info(request, _('[KEYMANAGER]: Deleting %d containers in the background.') % len(obj_ids))
+            return shortcuts.redirect(self.get_success_url(request))
+
+        deleted, failed = barbican_bridge.delete_containers(request, obj_ids)
+        if deleted:
+            messages.success(request, _('[KEYMANAGER]: %d containers deleted.') % len(deleted))
+        if failed:
+            for obj_id, error in failed:
+                LOG.error('Unable to delete container %s: %s', obj_id, error)
+            failed_ids = ", ".join([obj_id.split("/")[-1] for obj_id, error in failed])
+            messages.error(request, _('[KEYMANAGER]: Unable to delete containers: %s') % failed_ids)
+        return shortcuts.redirect(self.get_success_url(request))
+
+# popover cells for the consumers and secrets columns. These are built
+# with format_html instead of a template render per row, the popovers are
+# initialized once for the whole table by the index template.
+POPOVER = ('<a href="#" id="{0}" class="link-popover" rel="popover" tabindex="0" '
+           'data-trigger="focus" data-html="true" data-content="{1}" '
+           'data-original-title="{2}">{3}</a>')
+
+def _popover(dom_id, rows, title, label):
+    content = format_html("<table class='table table-bordered'>{0}</table>",
+                          format_html_join("", "<tr><th>{0}</th><td>{1}</td></tr>", rows))
+    return format_html(POPOVER, dom_id, escape(content), title, label)
+
+def _container_id(entity):
+    return entity.container_ref.split("/")[-1]
+
 def get_consumers(entity):
-    template_name = 'project/secretscontainers/_consumers.html'
-    if hasattr(entity, 'consumers'):
-        name = "".join(set([x.get('name') for x in entity.consumers]))
-        number_of_consumers = len(entity.consumers)
-        consumers_id = ",<br/>".join([x.get('URL').split("/")[-1] for x in entity.consumers])
-
-        context = {
-            "name": name,
-            "id": consumers_id,
-            "number_of_consumers": number_of_consumers,
-        }
-        return loader.render_to_string(template_name, context)
+    if entity.consumers:
+        consumers_id = format_html_join(mark_safe(",<br/>"), "{0}",
+                                        ((x,) for x in entity.consumer_ids))
+        rows = ((_('ID'), consumers_id),
+                (_('CONSUMERS'), len(entity.consumer_ids)))
+        return _popover("consumer_details_%s" % _container_id(entity), rows,
+                        _("Consumer Details: %s") % entity.consumer_label,
+                        entity.consumer_label)
     return _("No Consumer")
 
 def get_secrets(entity):
-    template_name = 'project/secretscontainers/_secrets.html'
-    if hasattr(entity, 'secrets'):
-        name = str(uuid.uuid1())
-        certificate_obj = entity.secrets.get('certificate')
-        private_key_obj = entity.secrets.get('private_key')
-
-        certificate_id = certificate_obj.secret_ref.split("/")[-1]
-        certificate_name = certificate_obj.name
-
-        private_key_id = private_key_obj.secret_ref.split("/")[-1]
-        private_key_name = private_key_obj.name
-
-        context = {
-            "name": name,
-            "certificate_id": certificate_id,
-            "certificate_name": certificate_name,
-            "private_key_id": private_key_id,
-            "private_key_name": private_key_name,
-        }
-        return loader.render_to_string(template_name, context)
-    return _("No Consumer")
+    certificate = entity.secret('certificate')
+    private_key = entity.secret('private_key')
+    if certificate and private_key:
+        rows = ((_('PRIVATE KEY ID'), private_key[0].split("/")[-1]),
+                (_('PRIVATE KEY NAME'), private_key[1]),
+                (_('CERTIFICATE ID'), certificate[0].split("/")[-1]),
+                (_('CERTIFICATE NAME'), certificate[1]))
+        container_id = _container_id(entity)
+        return _popover("secret_details_%s" % container_id, rows,
+                        _("Secret Details: %s") % entity.name, container_id)
+    return _("No Secrets")
 
 class SecretContainerTable(tables.DataTable):
     id = tables.Column('id', verbose_name=_('ID'), hidden=True)
@@ -109,8 +168,22 @@ class SecretContainerTable(tables.DataTable):
     type = tables.Column('type', verbose_name=_('Container Type'))
     status = tables.Column('status', verbose_name=_('Container Status'))
 
+    page_offset = 0
+    page_size = 0
+
+    def set_page(self, offset, page_size):
+        self.page_offset = offset
+        self.page_size = page_size
+
+    # barbican pages by offset, so the markers are listing offsets
+    def get_marker(self):
+        return str(self.page_offset + len(self.data))
+
+    def get_prev_marker(self):
+        return str(max(self.page_offset - self.page_size, 0))
+
     class Meta(object):
         name = "secretscontainers"
         verbose_name = _("Secrets Management: Containers")
-        table_actions = (ContainerCreateLink, )
+        table_actions = (ContainerFilterAction, ContainerCreateLink, ContainerExportLink, ContainerBrowseLink, )
         row_actions = (ContainerDeleteLink, )
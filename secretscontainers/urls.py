@@ -18,4 +18,8 @@ urlpatterns = [
     url(r'^$', views.IndexView.as_view(), name='index'),
     url(r'^index$', views.IndexView.as_view(), name='index'),
     url(r'^containers/create$', views.SecretsContainerCreateView.as_view(), name='containercreate'),
+    url(r'^export$', views.ContainerExportView.as_view(), name='export'),
+    url(r'^rows$', views.ContainerRowsView.as_view(), name='rows'),
+    url(r'^browse$', views.ContainerBrowseView.as_view(), name='browse'),
+    url(r'^secrets/search$', views.SecretSearchView.as_view(), name='secretsearch'),
 ]
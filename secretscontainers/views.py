@@ -13,36 +13,56 @@
 import logging
 
 from django.core.urlresolvers import reverse,reverse_lazy, NoReverseMatch
+from django import http
 from django.shortcuts import redirect
+from django.views import generic
 from django.utils.translation import ugettext_lazy as _
 from horizon import exceptions
 from horizon import forms
+from horizon import messages
 from horizon import tables
+from horizon import views as horizon_views
 
 from openstack_dashboard import settings
 from openstack_dashboard.api import barbican
+from openstack_dashboard.api import barbican_breaker
+from openstack_dashboard.api import barbican_conditional as conditional
+from openstack_dashboard.api import barbican_export as export
+from openstack_dashboard.api import barbican_rows as rows
 from openstack_dashboard.dashboards.project.secretscontainers import tables as secretscontainers_tables
 from openstack_dashboard.dashboards.project.secretscontainers import forms as secretscontainers_forms
 
 LOG = logging.getLogger(__name__)
 
-class SecretData(object):
-    def __init__(self, secret_object):
-        self.secret_object = secret_object
-        self.secret_object_dict = self.secret_object.__dict__
-        for k in self.secret_object_dict:
-            setattr(self, k, self.secret_object_dict.get(k))
+# secret picker candidates: barbican secret types searched and an extra
+# check for opaque secrets uploaded by the certificates panel (<name>_crt
+# and <name>_key)
+SECRET_KINDS = {
+    'certificate': (('certificate', 'opaque'),
+                    lambda x: x.get('secret_type') != 'opaque' or not (x.get('name') or '').endswith('_key')),
+    'private_key': (('private', 'opaque'),
+                    lambda x: x.get('secret_type') != 'opaque' or not (x.get('name') or '').endswith('_crt')),
+}
 
-        # map HREF to id
-        self.id = self.secret_object.container_ref
-        self.container_ref = self.id
-        self.name = self.secret_object.name
-        self.status = self.secret_object.status
-        self.type = self.secret_object._api.get(self.container_ref).get('type', '').lower()
+SECRET_SEARCH_LIMIT = 20
 
-        # map secrets and consumers
-        self.consumers = self.secret_object.consumers
-        self.secrets = self.secret_object.secrets
+class SecretSearchView(generic.View):
+    def get(self, request):
+        kind = SECRET_KINDS.get(request.GET.get('kind'))
+        if kind is None:
+            return http.HttpResponseBadRequest()
+        secret_types, match = kind
+        try:
+            secrets = barbican.search_secrets(request, query=request.GET.get('q'),
+                                              secret_types=secret_types, match=match,
+                                              limit=SECRET_SEARCH_LIMIT)
+        except:
+            exceptions.handle(request, ignore=True)
+            secrets = []
+        results = [{'id': x.get('secret_ref').split("/")[-1],
+                    'name': x.get('name'),
+                    'secret_type': x.get('secret_type')} for x in secrets]
+        return http.JsonResponse({'results': results})
 
 class SecretsContainerCreateView(forms.ModalFormView):
     template_name = 'project/secretscontainers/containercreate.html'
@@ -63,12 +83,153 @@ class IndexView(tables.DataTableView):
         context = super(IndexView, self).get_context_data(**kwargs)
         return context
 
+    def has_more_data(self, table):
+        return self._more
+
+    def has_prev_data(self, table):
+        return self._prev
+
+    # pagination markers carry the barbican listing offset
+    def get_offset(self):
+        meta = self.table._meta
+        offset = (self.request.GET.get(meta.prev_pagination_param) or
+                  self.request.GET.get(meta.pagination_param))
+        try:
+            return max(int(offset), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    etag = None
+
+    # the listing fingerprint is checked before anything is built: an
+    # unchanged page is answered with a 304, and rows already built for the
+    # same fingerprint are reused
+    def get(self, request, *args, **kwargs):
+        last_modified = None
+        if request.method == 'GET':
+            table = self.get_table()
+            self.etag, last_modified = conditional.listing_validators(
+                request, ('containers', 'secrets'), barbican.get_page_size(request),
+                table.get_filter_field(), table.get_filter_string())
+        if conditional.not_modified(request, self.etag):
+            response = http.HttpResponseNotModified()
+        else:
+            response = super(IndexView, self).get(request, *args, **kwargs)
+        return conditional.set_validators(response, self.etag, last_modified)
+
+    def build_rows(self, offset, page_size, filters):
+        containers, more, prev = barbican.get_containers(
+            self.request, offset=offset, limit=page_size, paginate=True, **filters)
+        secret_refs = set(x.get('secret_ref') for c in containers
+                          for x in c.get('secret_refs', []))
+        metadata = barbican.get_secrets_metadata(self.request, secret_refs)
+        objects = [barbican.ContainerRow.from_listing(container, metadata)
+                   for container in containers]
+        return objects, more, prev
+
     def get_data(self):
-        objects = []
+        self._more = self._prev = False
+        offset = self.get_offset()
+        page_size = barbican.get_page_size(self.request)
+        filters = self.get_filters()
+
+        def build():
+            return self.build_rows(offset, page_size, filters)
+
         try:
-            for container_object in barbican.get_containers(self.request):
-                objects.append(SecretData(container_object))
-        except:
+            if self.etag:
+                objects, self._more, self._prev = barbican.get_fingerprinted_rows(
+                    self.request, self.etag, build)
+            else:
+                objects, self._more, self._prev = build()
+        except barbican_breaker.CircuitOpen:
+            messages.warning(self.request, _('[KEYMANAGER]: Barbican is not responding, try again later.'))
+            objects = []
+        except Exception as e:
+            LOG.error("unable to list containers: %s", e)
+            messages.error(self.request, _('[KEYMANAGER]: Unable to retrieve the container list.'))
             objects = []
-    
+
+        if barbican.is_stale(self.request):
+            messages.warning(self.request, _('[KEYMANAGER]: Barbican is not responding, showing the last known containers.'))
+
+        self.table.set_page(offset, page_size)
         return objects
+
+CONTAINER_ROW_FIELDS = ('container_ref', 'name', 'type', 'status', 'created')
+CONTAINER_ROW_FILTERS = ('name', 'type')
+
+CONTAINER_BROWSE_COLUMNS = (
+    ('name', _('Container Name')),
+    ('type', _('Container Type')),
+    ('status', _('Container Status')),
+    ('certificate', _('Certificate')),
+    ('private_key', _('Private Key')),
+    ('consumers', _('Active Consumers')),
+    ('created', _('Created')),
+)
+
+# one page of container rows as JSON, for the virtualized table
+class ContainerRowsView(generic.View):
+    def get(self, request):
+        filters = rows.listing_filters(request, CONTAINER_ROW_FILTERS)
+
+        def build(offset, limit):
+            containers, has_more, has_prev = barbican.get_containers(
+                request, offset=offset, limit=limit, paginate=True, **filters)
+            secret_refs = set(x.get('secret_ref') for c in containers
+                              for x in c.get('secret_refs', []))
+            metadata = barbican.get_secrets_metadata(request, secret_refs)
+            results = []
+            for container in containers:
+                row = barbican.ContainerRow.from_listing(container, metadata)
+                data = row.to_dict(CONTAINER_ROW_FIELDS)
+                for slot in ('certificate', 'private_key'):
+                    secret = row.secret(slot)
+                    data[slot] = secret[1] or secret[0].split("/")[-1] if secret else None
+                data['consumers'] = [x[1] for x in row.consumers]
+                results.append(data)
+            return results, has_more
+
+        return rows.rows_response(request, ('containers', 'secrets'), build)
+
+# virtualized container table, rendering only the rows in view
+class ContainerBrowseView(horizon_views.HorizonTemplateView):
+    template_name = 'project/secretscontainers/browse.html'
+    page_title = _("Browse Containers")
+
+    def get_context_data(self, **kwargs):
+        context = super(ContainerBrowseView, self).get_context_data(**kwargs)
+        context['table_id'] = "secretscontainers_browse"
+        context['rows_url'] = "%s?%s" % (reverse('horizon:project:secretscontainers:rows'),
+                                         rows.rows_query(self.request))
+        context['columns'] = CONTAINER_BROWSE_COLUMNS
+        return context
+
+CONTAINER_EXPORT_FIELDS = ('container_ref', 'name', 'type', 'status', 'created', 'updated',
+                           'certificate_ref', 'private_key_ref', 'consumers')
+
+# stream the whole container inventory of the project
+class ContainerExportView(generic.View):
+    def get(self, request):
+        export_format = export.export_format(request)
+        if export_format is None:
+            return http.HttpResponseBadRequest()
+        return export.export_response(self.rows(request), CONTAINER_EXPORT_FIELDS,
+                                      export_format, "containers")
+
+    def rows(self, request):
+        for container in barbican.iter_containers(request):
+            secrets = dict((x.get('name'), x.get('secret_ref'))
+                           for x in container.get('secret_refs', []))
+            yield {
+                'container_ref': container.get('container_ref'),
+                'name': container.get('name'),
+                'type': container.get('type'),
+                'status': container.get('status'),
+                'created': container.get('created'),
+                'updated': container.get('updated'),
+                'certificate_ref': secrets.get('certificate'),
+                'private_key_ref': secrets.get('private_key'),
+                'consumers': [x.get('URL') for x in container.get('consumers', [])],
+            }